@@ -0,0 +1,201 @@
+import hashlib
+import logging
+import os
+import pickle
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+def approx_size(value: Any) -> int:
+    """הערכת זיכרון של ערך לפי גודל ה-pickle (אובייקטי פייתון תופסים בערך פי 2 בזיכרון)"""
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)) * 2
+
+
+def ensure_private_dir(path: str) -> None:
+    """
+    🔥 תיקייה פרטית לקבצי מטמון / sessions: נוצרת עם 0700, וחייבת להיות של המשתמש הנוכחי
+    ולא פתוחה לכתיבה לאחרים (שכבת הדיסק טוענת pickle - קובץ שהושתל שם הוא הרצת קוד)
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError(f"Cache directory {path} must be private to the current user")
+
+
+class BoundedCache:
+    """
+    🔥 מטמון LRU משותף לכל התהליך, מוגבל בבתים.
+    כל ערך נשמר עם הגודל המשוער שלו; כשחורגים מ-max_bytes נמחקים הערכים הישנים ביותר.
+    ttl_seconds: תוקף לכל ערך (None = ללא תפוגה)
+    disk_dir: שכבת דיסק אופציונלית - כל ערך נכתב גם כ-pickle, ושורד פינוי מהזיכרון ואתחול
+    spill: עם disk_dir - ערך נכתב לדיסק רק כשהוא מפונה מהזיכרון (ערכים קרים), ולא בכל put
+    """
+
+    def __init__(self, name: str, max_bytes: int, ttl_seconds: Optional[float] = None,
+                 disk_dir: Optional[str] = None, spill: bool = False):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.spill = spill
+        self._entries: "OrderedDict[Hashable, tuple[Any, int, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        if disk_dir:
+            ensure_private_dir(disk_dir)
+
+    # ───────── זיכרון ─────────
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        stored = self._disk_get(key)
+        with self._lock:
+            if stored is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        value, size, expires_at = stored
+        # קידום חזרה לזיכרון (בלי לכתוב שוב לדיסק); ב-spill הקובץ כבר לא נחוץ
+        if self.spill:
+            self._disk_remove(key)
+        self._memory_put(key, value, size, expires_at)
+        return value
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """מוסיף ערך; ערך גדול מכל המטמון לא נשמר בזיכרון (אבל כן בדיסק אם הוגדר)"""
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds else None
+        stored = self._memory_put(key, value, size, expires_at)
+        if not self.spill:
+            self._disk_put(key, value, size, expires_at)
+        elif stored:
+            self._disk_remove(key)
+        else:
+            self._disk_put(key, value, size, expires_at)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+        self._disk_remove(key)
+
+    def _memory_put(self, key: Hashable, value: Any, size: int, expires_at: Optional[float]) -> bool:
+        if size > self.max_bytes:
+            return False
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                evicted.append((oldest, self._entries[oldest]))
+                self._remove(oldest)
+                self.evictions += 1
+        # 🔥 ערכים קרים שפונו נשפכים לדיסק (מחוץ לנעילה)
+        if self.spill and self.disk_dir:
+            now = time.time()
+            for old_key, (old_value, old_size, old_expires_at) in evicted:
+                if old_expires_at is None or old_expires_at > now:
+                    self._disk_put(old_key, old_value, old_size, old_expires_at)
+                    with self._lock:
+                        self.spills += 1
+        return True
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    # ───────── דיסק ─────────
+    def _disk_path(self, key: Hashable) -> str:
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{self.name}_{digest}.pkl")
+
+    def _disk_get(self, key: Hashable) -> Optional[tuple]:
+        """(value, size, expires_at) מהדיסק, או None אם אין / פג תוקף"""
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_key, value, size, expires_at = pickle.load(f)
+            if stored_key != key:
+                return None
+            if expires_at is not None and expires_at < time.time():
+                os.remove(path)
+                return None
+            return value, size, expires_at
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"⚠️ Cache '{self.name}' disk read failed: {e}")
+            return None
+
+    def _disk_put(self, key: Hashable, value: Any, size: int, expires_at: Optional[float]) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((key, value, size, expires_at), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"⚠️ Cache '{self.name}' disk write failed: {e}")
+            return
+        self._disk_prune()
+
+    def _disk_remove(self, key: Hashable) -> None:
+        if not self.disk_dir:
+            return
+        try:
+            os.remove(self._disk_path(key))
+        except OSError:
+            pass
+
+    def _disk_files(self):
+        return [e for e in os.scandir(self.disk_dir) if e.name.startswith(f"{self.name}_")]
+
+    def _disk_prune(self) -> None:
+        """מוחק מהדיסק ערכים שפג תוקפם (לפי זמן הכתיבה - גבול עליון בטוח)"""
+        if not self.ttl_seconds:
+            return
+        now = time.time()
+        for entry in self._disk_files():
+            if now - entry.stat().st_mtime > self.ttl_seconds:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "disk_entries": len(self._disk_files()) if self.disk_dir else 0,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,2 @@
+# test_api.py הוא סקריפט ידני (קורא contacts_file.xlsx מקומי) ולא בדיקת pytest
+collect_ignore = ["test_api.py"]
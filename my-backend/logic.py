@@ -9,8 +9,17 @@ __all__ = [
     
     # פונקציות התאמות
     'top_matches',
+    'match_guest',
+    'build_contact_index',
+    'score_matrix',
+    'blocked_scores',
+    'iter_guest_matches',
+    'ContactIndex',
+    'estimate_contacts_bytes',
     'full_score',
     'process_matching_results',
+    'iter_matching_results',
+    'result_tier',
     'compute_best_scores',
     'extract_relevant_guest_details',
     'extract_smart_fields',
@@ -18,16 +27,28 @@ __all__ = [
     # פונקציות בדיקה
     'validate_dataframes',
     'is_user_authorized',
+    'scan_phone_column',
     
     # פונקציות ייצוא
     'to_buf',
     'export_with_original_structure',  # 🔥 חדש
+    'ExportFrame',
+    'prepare_export_frame',
+    'parse_workbook',
+    'fill_export_phones',
+    'export_patched_workbook',
+    'iter_frame_bytes',
+    'iter_export_bytes',
+    'EXPORT_FORMATS',
+    'read_table',
     'create_contacts_template',
     'create_guests_template',
     
     # פונקציות עזר
     'format_phone',
     'normalize',
+    'normalize_many',
+    'name_cache_stats',
     'reason_for',
     
     # קבועים
@@ -40,16 +61,31 @@ __all__ = [
     'AUTO_SELECT_TH',
     'MIN_SCORE_DISPLAY',
     'MAX_DISPLAYED',
+    'MAX_PERFECT_RESULTS',
+    'MATCH_ENGINE_VERSION',
     'FIELD_PRIORITY',
 ]
 
 import os, re, logging, json
+import copy
+import csv
+import html
+import itertools
+import multiprocessing
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
-from typing import List, Set, Dict, Optional
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Iterator, List, Set, Dict, Optional, NamedTuple
 
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
+from pandas._libs.parsers import STR_NA_VALUES  # אותם ערכי NA כמו ב-read_excel
 import unidecode
-from rapidfuzz import fuzz, distance
+from rapidfuzz import fuzz, distance, process
 
 
 import io, os, json, logging, traceback
@@ -81,6 +117,29 @@ AUTO_SCORE        = 100
 AUTO_SELECT_TH    = 93
 MIN_SCORE_DISPLAY = 70
 MAX_DISPLAYED     = 3
+MAX_PERFECT_RESULTS = 30
+
+# 🔥 מצב חישוב ציונים: "blocked" (blocking + ציון למועמדים), "batch" (מטריצות cdist) או "pairwise" (זוג-זוג)
+MATCH_SCORING     = os.environ.get("MATCH_SCORING", "blocked")
+MATCH_BATCH_ROWS  = int(os.environ.get("MATCH_BATCH_ROWS", "256"))
+# threads לכל קריאת cdist: כל הליבות, ו-1 בתוך worker של ה-process pool (שם המקביליות היא בין התהליכים)
+_CDIST_WORKERS    = -1
+# 🔥 שלב hash join לפני ה-fuzzy: מוזמן עם איש קשר זהה נפתר בלי מנוע ה-fuzzy המלא
+# (מועמדים חלופיים 90-99 מחושבים רק מול אנשי קשר עם טוקן דומה - אותה תוצאה)
+EXACT_MATCH_STAGE = os.environ.get("EXACT_MATCH_STAGE", "true").lower() == "true"
+# 🔥 התאמה מקבילית (opt-in): מספר תהליכים, ומתחת לסף המוזמנים - ריצה רציפה.
+# ה-workers נוצרים ב-fork מתוך thread של השרת (תהליך מרובה threads): ה-worker מריץ רק קוד התאמה
+# (בלי import / logging / print), אבל עדיף להפעיל רק על instance ייעודי למיזוגים
+MATCH_WORKERS       = int(os.environ.get("MATCH_WORKERS", "0"))
+PARALLEL_MIN_GUESTS = int(os.environ.get("PARALLEL_MIN_GUESTS", "500"))
+# 🔥 גרסת מנוע הציונים - חלק ממפתח מטמון התוצאות; להעלות בכל שינוי שמשנה תוצאות
+MATCH_ENGINE_VERSION = "2"
+# 🔥 קליטת אנשי קשר בסטרימינג (openpyxl read-only, רק העמודות הנחוצות)
+STREAMING_INGEST = os.environ.get("STREAMING_INGEST", "true").lower() == "true"
+STREAM_SAMPLE_ROWS = 10
+CONTACTS_PHONE_RE = re.compile(r'972\d{9}')
+# 🔥 memo משותף לכל הבקשות ל-normalize / _tokens / _clean_token (מספר רשומות לכל אחד, LRU)
+NAME_CACHE_SIZE = int(os.environ.get("NAME_CACHE_SIZE", "50000"))
 
 # 🔥 סדר עדיפות לשדות בפרופיל מוזמן (רק השדות החשובים!)
 FIELD_PRIORITY = {
@@ -118,19 +177,51 @@ def only_digits(s: str) -> str:
     """מחזיר רק ספרות מהמחרוזת"""
     return re.sub(r"\D+", "", s or "")
 
-_punc_re   = re.compile(r"[\|\\/()\[\]\"'׳״.,\-]+")
-_space_re  = re.compile(r"\s+")
+_PUNC_CHARS = "|\\/()[]\"'׳״.,-"
+# פיסוק → רווח ב-str.translate (רשימה לפי code point; תווים מעבר לסוף הרשימה לא משתנים)
+_PUNC_TO_SPACE = [" " if chr(cp) in _PUNC_CHARS else chr(cp) for cp in range(max(map(ord, _PUNC_CHARS)) + 1)]
 _token_re  = re.compile(r"\s+")
 
+def _build_translit_table() -> List[str]:
+    """
+    🔥 טבלת str.translate מוכנה מראש (רשימה לפי code point - מהירה מ-dict): התעתיק של unidecode לתווים
+    לטיניים, יווניים / קיריליים, עבריים, ערביים ופיסוק כללי. unidecode מתעתק תו-תו בלי הקשר,
+    כך שהתוצאה זהה; שאר התווים נשארים כמו שהם ו-_transliterate עובר בשבילם ל-unidecode
+    """
+    ranges = [(0x0080, 0x0250), (0x0370, 0x0530), (0x0590, 0x0700), (0x2000, 0x2070)]
+    table = [chr(cp) for cp in range(ranges[-1][1])]
+    for start, end in ranges:
+        for cp in range(start, end):
+            table[cp] = unidecode.unidecode(chr(cp))
+    return table
+
+_TRANSLIT_TABLE = _build_translit_table()
+
+def _transliterate(t: str) -> str:
+    """כמו unidecode.unidecode(t): דרך הטבלה, ו-unidecode רק אם נשארו תווים שלא בה"""
+    if t.isascii():
+        return t
+    out = t.translate(_TRANSLIT_TABLE)
+    return out if out.isascii() else unidecode.unidecode(t)
+
+@lru_cache(maxsize=NAME_CACHE_SIZE, typed=True)  # typed: 1 / 1.0 / True מתנרמלים אחרת
 def normalize(txt: str | None) -> str:
     """נירמול משופר"""
     if not txt:
         return ""
-    t = str(txt).lower()
-    t = _punc_re.sub(" ", t)
-    t = _space_re.sub(" ", t).strip()
-    return unidecode.unidecode(t)
+    # split/join = כיווץ רווחים + strip (אותה הגדרת whitespace כמו \s)
+    t = " ".join(str(txt).lower().translate(_PUNC_TO_SPACE).split())
+    return _transliterate(t)
 
+def normalize_many(values) -> List[str]:
+    """
+    🔥 normalize על Series / רשימה שלמה - לולאה אחת על רשימת פייתון במקום Series.map.
+    (בלי dedupe: רוב השמות ייחודיים, ו-dict של ערכים ייחודיים עולה יותר ממה שהוא חוסך)
+    """
+    values = values.tolist() if isinstance(values, pd.Series) else values
+    return [normalize(v) for v in values]
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def _clean_token(tok: str) -> str:
     """מסיר ו' חיבור, סיומת i, ומתעלם מ־SUFFIX_TOKENS"""
     if tok in SUFFIX_TOKENS:
@@ -141,27 +232,51 @@ def _clean_token(tok: str) -> str:
         tok = tok[:-1]
     return tok
 
-def _tokens(name: str) -> List[str]:
-    """מחזיר רשימת טוקנים נקייה"""
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _tokens(name: str) -> tuple:
+    """מחזיר את הטוקנים הנקיים (tuple - משותף בין קריאות דרך ה-memo)"""
     tks = [_clean_token(t) for t in _token_re.split(name)]
-    return [t for t in tks if t and t not in GENERIC_TOKENS]
+    return tuple([t for t in tks if t and t not in GENERIC_TOKENS])
+
+def name_cache_stats() -> Dict[str, Dict[str, Any]]:
+    """מוני hit / miss של ה-memo של השמות (לכל תהליך)"""
+    stats = {}
+    for label, func in (("normalize", normalize), ("tokens", _tokens), ("clean_token", _clean_token)):
+        info = func.cache_info()
+        lookups = info.hits + info.misses
+        stats[label] = {
+            "entries": info.currsize,
+            "max_entries": info.maxsize,
+            "hits": info.hits,
+            "misses": info.misses,
+            "hit_rate": round(info.hits / lookups, 3) if lookups else 0.0,
+        }
+    return stats
 
 def _fuzzy_eq(a: str, b: str) -> bool:
     """טוקנים זהים או דומים ≥ 90 % ב‑Levenshtein"""
     return a == b or distance.Levenshtein.normalized_similarity(a, b) >= 0.9
 
-def _fuzzy_jaccard(gs: List[str], cs: List[str]) -> float:
-    """חישוב Jaccard עם התחשבות ב-fuzzy equality"""
+def _fuzzy_jaccard(gs: List[str], cs: List[str], g_unique: Optional[int] = None, c_unique: Optional[int] = None,
+                   eq_pairs: Optional[Set[tuple]] = None) -> float:
+    """
+    חישוב Jaccard עם התחשבות ב-fuzzy equality (מספר הטוקנים הייחודיים יכול להגיע מהאינדקס).
+    eq_pairs: קבוצת זוגות (g, c) דומים שחושבה מראש - חוסך את חישוב ה-Levenshtein
+    """
     matched, used = 0, set()
     for g in gs:
         for c in cs:
             if c in used:
                 continue
-            if _fuzzy_eq(g, c):
+            if ((g, c) in eq_pairs) if eq_pairs is not None else _fuzzy_eq(g, c):
                 matched += 1
                 used.add(c)
                 break
-    union = len(set(gs)) + len(set(cs)) - matched
+    if g_unique is None:
+        g_unique = len(set(gs))
+    if c_unique is None:
+        c_unique = len(set(cs))
+    union = g_unique + c_unique - matched
     return matched / union if union else 1.0
 
 def format_phone(ph: str) -> str:
@@ -238,50 +353,159 @@ def identify_relevant_fields(df: pd.DataFrame) -> Dict[str, str]:
     
     return relevant_fields
 
-def _resolve_full_name_series(df: pd.DataFrame) -> pd.Series:
-    """מאחד שם פרטי+משפחה / מזהה 'שם מלא'"""
-    cols = list(df.columns)
+def _full_name_columns(cols: list) -> tuple[str, list]:
+    """
+    מאילו עמודות נבנה השם המלא - לפי הכותרות בלבד:
+    direct / first_last / name_like (מועמדות - נבחרת הארוכה בממוצע) / first_column / none
+    """
     low = {c: str(c).strip().lower() for c in cols}
     
     direct = {"שם מלא", "full name", "fullname", "guest name", "שם המוזמן", "name"}
     for c in cols:
         if low[c] in direct:
-            return df[c].fillna("").astype(str).str.strip()
+            return "direct", [c]
     
     first = [c for c in cols if "פרטי" in low[c] or low[c] in {"שם", "first", "firstname", "given"}]
     last  = [c for c in cols if "משפחה" in low[c] or low[c] in {"last", "lastname", "surname", "family"}]
     
     if first and last:
-        f = first[0]
-        l = last[0]
-        return (df[f].fillna("").astype(str).str.strip() + " " +
-                df[l].fillna("").astype(str).str.strip()).str.replace(r"\s+", " ", regex=True).str.strip()
+        return "first_last", [first[0], last[0]]
     
     name_like = [c for c in cols if any(k in low[c] for k in ["שם", "name", "guest", "מוזמן"])]
     if name_like:
-        best_col = max(name_like, key=lambda col: df[col].astype(str).str.len().mean())
+        return "name_like", name_like
+    
+    if len(cols) > 0:
+        return "first_column", [cols[0]]
+    
+    return "none", []
+
+def _resolve_full_name_series(df: pd.DataFrame) -> pd.Series:
+    """מאחד שם פרטי+משפחה / מזהה 'שם מלא'"""
+    kind, name_cols = _full_name_columns(list(df.columns))
+    
+    if kind == "first_last":
+        f, l = name_cols
+        return (df[f].fillna("").astype(str).str.strip() + " " +
+                df[l].fillna("").astype(str).str.strip()).str.replace(r"\s+", " ", regex=True).str.strip()
+    
+    if kind == "name_like":
+        best_col = max(name_cols, key=lambda col: df[col].astype(str).str.len().mean())
         return df[best_col].fillna("").astype(str).str.strip()
     
-    if len(df.columns) > 0:
-        return df.iloc[:, 0].fillna("").astype(str).str.strip()
+    if name_cols:
+        return df[name_cols[0]].fillna("").astype(str).str.strip()
     
     return pd.Series([""] * len(df))
 
 # ───────── טעינת קבצים ─────────
-def load_excel_flexible(file) -> pd.DataFrame:
-    """טעינת קובץ עם זיהוי אוטומטי"""
+def read_table(file, nrows: Optional[int] = None) -> pd.DataFrame:
+    """קריאת הקובץ כמו שהוא (csv / אקסל), עם שמות עמודות נקיים. nrows: רק N שורות ראשונות"""
+    if hasattr(file, "filename") and str(file.filename).lower().endswith(".csv"):
+        df = pd.read_csv(file, encoding='utf-8', nrows=nrows)
+    else:
+        df = pd.read_excel(file, nrows=nrows)
+    df.columns = [str(col).strip() for col in df.columns]
+    return df
+
+def _excel_cell_value(cell):
+    """המרת תא כמו ב-pd.read_excel (OpenpyxlReader._convert_cell)"""
+    value = cell.value
+    if value is None:
+        return ""
+    if cell.data_type == "e":
+        return np.nan
+    if cell.data_type == "n" and not isinstance(value, bool):
+        as_int = int(value)
+        return as_int if as_int == value else float(value)
+    return value
+
+def _is_empty_cell(value) -> bool:
+    """ערך ש-pandas הופך ל-NaN (תא ריק / שגיאה / 'N/A' וכו')"""
+    if isinstance(value, str):
+        return value in STR_NA_VALUES
+    return isinstance(value, float) and value != value
+
+def _stream_contacts_frame(file) -> Optional[pd.DataFrame]:
+    """
+    🔥 קליטת קובץ אנשי קשר בסטרימינג (openpyxl read-only): שורה אחר שורה, רק עמודות 0 (טלפון) ו-2 (שם).
+    הזיהוי לפי הכותרת + STREAM_SAMPLE_ROWS שורות ראשונות; ההמרות זהות ל-pd.read_excel + dropna.
+    מחזיר None אם זה לא אנשי קשר / לא xlsx - ואז הקריאה המלאה הרגילה
+    """
+    if not STREAMING_INGEST or (hasattr(file, "filename") and str(file.filename).lower().endswith(".csv")):
+        return None
+    start = file.tell()
+    if not zipfile.is_zipfile(file):
+        file.seek(start)
+        return None
+    file.seek(start)
+
+    from openpyxl import load_workbook
+    wb = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+        rows = []  # rows[0] = כותרת
+        empty_rows = []  # שורות ריקות לגמרי נשארות עד ההמרה (משפיעות על ה-dtype, כמו ב-read_excel) ונמחקות אחריה
+        sample = []
+        width = 0
+        last_row_with_data = 0
+        for cells in ws.rows:
+            values = [_excel_cell_value(cell) for cell in cells]
+            while values and values[-1] == "":
+                values.pop()
+            width = max(width, len(values))
+            rows.append([values[i] if i < len(values) else "" for i in (0, 2)])
+            if len(rows) == 1:
+                continue
+            if values:
+                last_row_with_data = len(rows)
+            if all(_is_empty_cell(v) for v in values):
+                empty_rows.append(len(rows) - 2)
+            elif len(sample) < STREAM_SAMPLE_ROWS:
+                sample.append(rows[-1][0])
+                # אחרי הדגימה: בלי 972XXXXXXXXX בעמודה הראשונה → לא אנשי קשר, חוזרים לקריאה המלאה
+                if len(sample) == STREAM_SAMPLE_ROWS and not any(CONTACTS_PHONE_RE.search(str(v)) for v in sample):
+                    return None
+    finally:
+        wb.close()
+        file.seek(start)
+
+    # שורות ריקות בסוף הגיליון נחתכות (כמו ב-read_excel)
+    del rows[last_row_with_data:]
+    empty_rows = [pos for pos in empty_rows if pos < len(rows) - 1]
+    if width < 3 or len(rows) < 2:
+        return None
+    projection = TextParser(rows, header=0).read().drop(index=empty_rows)
+    if not projection.iloc[:, 0].astype(str).str.contains(CONTACTS_PHONE_RE).any():
+        return None
+    print(f"📊 Streamed {len(projection)} rows (columns 0, 2 of {width})")
+    return projection
+
+def load_excel_flexible(file, parsed: Optional[ExportFrame] = None) -> pd.DataFrame:
+    """
+    טעינת קובץ עם זיהוי אוטומטי.
+    parsed: הקובץ כבר נקרא וזוהה (parse_workbook) - לא קוראים ולא מזהים שוב
+    """
     try:
         print(f"📁 Reading file: {getattr(file, 'filename', 'unknown')}")
         
-        if hasattr(file, "filename") and str(file.filename).lower().endswith(".csv"):
-            df = pd.read_csv(file, encoding='utf-8')
-        else:
-            df = pd.read_excel(file)
+        streamed = _stream_contacts_frame(file) if parsed is None else None
+        if streamed is not None:
+            print("📞 Contacts file")
+            standard_df = pd.DataFrame({
+                PHONE_COL: streamed.iloc[:, 0].astype(str).str.strip(),
+                NAME_COL: streamed.iloc[:, 1].astype(str).str.strip(),
+            })
+            return _finalize_standard_df(standard_df)
+        
+        df = read_table(file) if parsed is None else parsed.df
         
         print(f"📊 Shape: {df.shape}")
         print(f"📋 Columns: {list(df.columns)}")
         
-        df.columns = [str(col).strip() for col in df.columns]
+        # זיהוי העמודות מ-parsed תקף רק אם dropna לא הוריד שורות (אותו head(10), אותו יישור שמות)
+        reuse_parsed = parsed is not None and not df.isna().all(axis=1).any()
         df = df.dropna(how='all')
         
         if len(df) == 0:
@@ -289,7 +513,7 @@ def load_excel_flexible(file) -> pd.DataFrame:
         
         is_contacts_file = (
             len(df.columns) >= 3 and 
-            df.iloc[:, 0].astype(str).str.contains(r'972\d{9}').any()
+            df.iloc[:, 0].astype(str).str.contains(CONTACTS_PHONE_RE).any()
         )
         
         standard_df = pd.DataFrame()
@@ -301,12 +525,15 @@ def load_excel_flexible(file) -> pd.DataFrame:
         else:
             print("👰 Guests file - Processing all relevant columns")
             
-            column_mapping = smart_column_mapping(df)
+            column_mapping = parsed.column_mapping if reuse_parsed else smart_column_mapping(df)
             
             # 1. ADD CORE FIELDS (NAME, PHONE, COUNT)
             
             # a. NAME_COL
-            standard_df[NAME_COL] = _resolve_full_name_series(df)
+            if reuse_parsed:
+                standard_df[NAME_COL] = pd.Series(parsed.names, index=df.index)
+            else:
+                standard_df[NAME_COL] = _resolve_full_name_series(df)
             name_col_used = [col for col, type_val in column_mapping.items() if type_val == 'name'][0] if [col for col, type_val in column_mapping.items() if type_val == 'name'] else None
             
             # b. PHONE_COL
@@ -362,19 +589,23 @@ def load_excel_flexible(file) -> pd.DataFrame:
                  else:
                     standard_df[GROUP_COL] = ""
         
-        standard_df["norm_name"] = standard_df[NAME_COL].map(normalize)
-        standard_df = standard_df[standard_df["norm_name"].str.strip() != ""]
-        
-        if len(standard_df) == 0:
-            raise Exception("לא נמצאו רשומות תקינות")
-        
-        print(f"✅ Final shape: {standard_df.shape}")
-        return standard_df
+        return _finalize_standard_df(standard_df)
         
     except Exception as e:
         print(f"❌ Error: {e}")
         raise Exception(f"לא ניתן לקרוא: {str(e)}")
 
+def _finalize_standard_df(standard_df: pd.DataFrame) -> pd.DataFrame:
+    """norm_name + סינון שורות בלי שם"""
+    standard_df["norm_name"] = normalize_many(standard_df[NAME_COL])
+    standard_df = standard_df[standard_df["norm_name"].str.strip() != ""]
+    
+    if len(standard_df) == 0:
+        raise Exception("לא נמצאו רשומות תקינות")
+    
+    print(f"✅ Final shape: {standard_df.shape}")
+    return standard_df
+
 def load_mobile_contacts(contacts_data: List[Dict]) -> pd.DataFrame:
     """טעינת אנשי קשר ממובייל"""
     try:
@@ -390,7 +621,7 @@ def load_mobile_contacts(contacts_data: List[Dict]) -> pd.DataFrame:
         standard_df[COUNT_COL] = 1
         standard_df[SIDE_COL] = ""
         standard_df[GROUP_COL] = ""
-        standard_df["norm_name"] = standard_df[NAME_COL].map(normalize)
+        standard_df["norm_name"] = normalize_many(standard_df[NAME_COL])
         
         standard_df = standard_df[
             (standard_df["norm_name"].str.strip() != "") & 
@@ -412,14 +643,133 @@ def load_excel(file) -> pd.DataFrame:
     return load_excel_flexible(file)
 
 # ───────── אלגוריתם התאמה ─────────
-def full_score(g_norm: str, c_norm: str) -> int:
-    """ציון התאמה 0–100"""
+class NameProfile(NamedTuple):
+    """טוקנים מחושבים מראש לשם מנורמל"""
+    stripped: str
+    tokens: tuple
+    joined: str
+    first: str
+    token_set: Set[str]
+    length: int
+    set_joined: str
+
+def name_profile(norm: str) -> NameProfile:
+    """בונה NameProfile לשם מנורמל"""
+    tks = _tokens(norm)
+    token_set = set(tks)
+    return NameProfile(
+        stripped=norm.strip(),
+        tokens=tks,
+        joined=" ".join(tks),
+        first=tks[0] if tks else "",
+        token_set=token_set,
+        length=len(tks),
+        set_joined=" ".join(sorted(token_set)),
+    )
+
+def _deletion_variants(tok: str) -> Set[str]:
+    """
+    וריאנטים של טוקן במחיקת עד ⌊len/9⌋ תווים (deletion neighbourhood).
+    שני טוקנים עם _fuzzy_eq (מרחק ≤ 10 % מהארוך) תמיד חולקים וריאנט.
+    """
+    variants = {tok}
+    frontier = {tok}
+    for _ in range(len(tok) // 9):
+        frontier = {t[:i] + t[i + 1:] for t in frontier for i in range(len(t))}
+        variants |= frontier
+    return variants
+
+@dataclass
+class ContactIndex:
+    """
+    🔥 אינדקס אנשי קשר - נבנה פעם אחת לכל contacts_df ומשמש את כל המוזמנים.
+    הציון תלוי רק ב-norm_name, ולכן כל שדות הציון בנויים על שמות ייחודיים (מיקום = שם ייחודי);
+    rows / members ממפים בין שורות contacts_df לשמות הייחודיים (fan-out אחרי הציון).
+    """
+    norms: List[str]
+    names: List[str]
+    profiles: List[NameProfile]
+    # שורה → מיקום השם הייחודי, ושם ייחודי → השורות שלו (בסדר עולה)
+    rows: List[int] = field(default_factory=list)
+    members: List[List[int]] = field(default_factory=list)
+    # עמודות לחישוב מטריצות (cdist)
+    joined: List[str] = field(default_factory=list)
+    firsts: List[str] = field(default_factory=list)
+    lengths: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    token_postings: Dict[str, List[int]] = field(default_factory=dict)
+    # blocking: וריאנט מחיקה → טוקנים, טוקנים ממוינים לכל שם, ושמות ללא טוקנים
+    variant_postings: Dict[str, List[str]] = field(default_factory=dict)
+    set_joined: List[str] = field(default_factory=list)
+    empty_positions: List[int] = field(default_factory=list)
+    # hash join: שם מנורמל / רצף טוקנים → מיקומים (שני המקרים שבהם full_score מחזיר AUTO_SCORE)
+    by_stripped: Dict[str, List[int]] = field(default_factory=dict)
+    by_tokens: Dict[tuple, List[int]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.norms)
+
+    def expand(self, positions) -> List[int]:
+        """מיקומי שמות ייחודיים → כל השורות שלהם ב-contacts_df, בסדר עולה"""
+        return sorted(r for u in positions for r in self.members[u])
+
+def build_contact_index(contacts_df: pd.DataFrame) -> ContactIndex:
+    """טוקניזציה חד-פעמית של כל אנשי הקשר - פעם אחת לכל שם ייחודי"""
+    positions: Dict[str, int] = {}
+    rows = [positions.setdefault(c, len(positions)) for c in contacts_df["norm_name"].tolist()]
+    norms = list(positions)
+    members: List[List[int]] = [[] for _ in norms]
+    for r, u in enumerate(rows):
+        members[u].append(r)
+    profiles = [name_profile(c) for c in norms]
+
+    postings: Dict[str, List[int]] = {}
+    for i, p in enumerate(profiles):
+        for t in p.token_set:
+            postings.setdefault(t, []).append(i)
+
+    variants: Dict[str, List[str]] = {}
+    for t in postings:
+        for v in _deletion_variants(t):
+            variants.setdefault(v, []).append(t)
+
+    by_stripped: Dict[str, List[int]] = {}
+    by_tokens: Dict[tuple, List[int]] = {}
+    for i, (c, p) in enumerate(zip(norms, profiles)):
+        if c:
+            by_stripped.setdefault(p.stripped, []).append(i)
+            by_tokens.setdefault(tuple(p.tokens), []).append(i)
+
+    return ContactIndex(
+        norms=norms,
+        names=contacts_df[NAME_COL].tolist(),
+        profiles=profiles,
+        rows=rows,
+        members=members,
+        joined=[p.joined for p in profiles],
+        firsts=[p.first for p in profiles],
+        lengths=np.array([p.length for p in profiles], dtype=np.int64),
+        token_postings=postings,
+        variant_postings=variants,
+        set_joined=[p.set_joined for p in profiles],
+        empty_positions=[i for i, p in enumerate(profiles) if not p.tokens],
+        by_stripped=by_stripped,
+        by_tokens=by_tokens,
+    )
+
+def estimate_contacts_bytes(contacts_df: pd.DataFrame, index: ContactIndex) -> int:
+    """הערכת זיכרון של ספר אנשי קשר מעובד (DataFrame + אינדקס) - לגבולות מטמון"""
+    df_bytes = int(contacts_df.memory_usage(deep=True).sum())
+    # פרופיל + רשומות במילוני האינדקס: כ-1.2KB לאיש קשר (נמדד עם tracemalloc)
+    return df_bytes + len(index.names) * 1200
+
+def _score_profiles(g_norm: str, gp: NameProfile, c_norm: str, cp: NameProfile) -> int:
+    """ציון התאמה בין שני שמות עם טוקנים מחושבים מראש"""
     if not g_norm or not c_norm:
         return 0
-    if g_norm.strip() == c_norm.strip():
+    if gp.stripped == cp.stripped:
         return AUTO_SCORE
         
-    g_t, c_t = _tokens(g_norm), _tokens(c_norm)
+    g_t, c_t = gp.tokens, cp.tokens
     
     if g_t == c_t:
         return AUTO_SCORE
@@ -427,65 +777,354 @@ def full_score(g_norm: str, c_norm: str) -> int:
     if not g_t or not c_t:
         return fuzz.partial_ratio(g_norm, c_norm)
     
-    tr = fuzz.token_set_ratio(" ".join(g_t), " ".join(c_t)) / 100
-    fr = fuzz.ratio(g_t[0], c_t[0]) / 100
-    jr = _fuzzy_jaccard(g_t, c_t)
+    tr = fuzz.token_set_ratio(gp.joined, cp.joined) / 100
+    fr = fuzz.ratio(gp.first, cp.first) / 100
+    jr = _fuzzy_jaccard(g_t, c_t, len(gp.token_set), len(cp.token_set))
     
-    gap = abs(len(g_t) - len(c_t))
-    penalty = (min(len(g_t), len(c_t)) / max(len(g_t), len(c_t))) if gap >= 2 else 1
+    gap = abs(gp.length - cp.length)
+    penalty = (min(gp.length, cp.length) / max(gp.length, cp.length)) if gap >= 2 else 1
     
     score = (0.6 * tr + 0.2 * fr + 0.2 * jr) * penalty * 100
     return int(round(score))
 
-def reason_for(g_norm: str, c_norm: str, score: int) -> str:
-    """הסבר לציון"""
-    overlap = [t for t in _tokens(g_norm) if t in set(_tokens(c_norm))]
+def full_score(g_norm: str, c_norm: str) -> int:
+    """ציון התאמה 0–100"""
+    if not g_norm or not c_norm:
+        return 0
+    return _score_profiles(g_norm, name_profile(g_norm), c_norm, name_profile(c_norm))
+
+def _reason_from_profiles(gp: NameProfile, cp: NameProfile, score: int) -> str:
+    """הסבר לציון מטוקנים מחושבים מראש"""
+    overlap = [t for t in gp.tokens if t in cp.token_set]
     if overlap:
         return f"חפיפה: {', '.join(overlap[:2])}"
     if score >= AUTO_SELECT_TH:
         return "התאמה גבוהה"
     return ""
 
-def top_matches(guest_norm: str, contacts_df: pd.DataFrame, limit_to_three: bool = False) -> pd.DataFrame:
+def reason_for(g_norm: str, c_norm: str, score: int) -> str:
+    """הסבר לציון"""
+    return _reason_from_profiles(name_profile(g_norm), name_profile(c_norm), score)
+
+def _pick_positions(scores: np.ndarray, index: ContactIndex, max_score: int, limit_to_three: bool = False) -> List[int]:
+    """
+    בחירת עד 3 מועמדים (שורות) לפי ציון ואז שם.
+    scores לפי שמות ייחודיים - רק השמות שעברו את הסף נפרשים לשורות שלהם
+    """
+    if (limit_to_three and max_score >= AUTO_SELECT_TH) or max_score == AUTO_SCORE:
+        threshold, limit = 90, 3
+    else:
+        threshold, limit = MIN_SCORE_DISPLAY, MAX_DISPLAYED
+    passing = index.expand(np.flatnonzero(scores >= threshold).tolist())
+    passing.sort(key=lambda r: (-scores[index.rows[r]], index.names[r]))
+    return passing[:limit]
+
+def _candidates_frame(guest_norm: str, contacts_df: pd.DataFrame, index: ContactIndex, scores: list, positions: List[int]) -> pd.DataFrame:
+    """בונה טבלת מועמדים עם score ו-reason (positions = שורות, scores לפי שמות ייחודיים)"""
+    candidates = contacts_df.iloc[positions].copy()
+    uniques = [index.rows[r] for r in positions]
+    candidates["score"] = [scores[u] for u in uniques]
+    if len(candidates) > 0:
+        gp = name_profile(guest_norm)
+        candidates["reason"] = [
+            _reason_from_profiles(gp, index.profiles[u], scores[u]) for u in uniques
+        ]
+    return candidates
+
+def _score_guest(guest_norm: str, index: ContactIndex) -> np.ndarray:
+    """ציון מוזמן מול כל אנשי הקשר באינדקס"""
+    gp = name_profile(guest_norm)
+    return np.array([
+        _score_profiles(guest_norm, gp, c_norm, cp)
+        for c_norm, cp in zip(index.norms, index.profiles)
+    ])
+
+def _fuzzy_token_pairs(g_tokens: List[str], index: ContactIndex) -> Set[tuple]:
+    """זוגות (טוקן מוזמן, טוקן איש קשר) שדומים ≥ 90 % - מטריצה אחת ב-cdist"""
+    c_tokens = list(index.token_postings)
+    if not g_tokens or not c_tokens:
+        return set()
+    sim = process.cdist(
+        g_tokens, c_tokens,
+        scorer=distance.Levenshtein.normalized_similarity,
+        score_cutoff=0.9, dtype=np.float64, workers=_CDIST_WORKERS,
+    )
+    rows, cols = np.nonzero(sim)
+    return {(g_tokens[r], c_tokens[c]) for r, c in zip(rows.tolist(), cols.tolist())}
+
+def score_matrix(guest_norms: List[str], index: ContactIndex) -> np.ndarray:
+    """
+    🔥 מטריצת ציונים מוזמנים × אנשי קשר - זהה ל-full_score לכל זוג.
+    token_set_ratio ו-ratio של הטוקן הראשון מחושבים בקריאת cdist אחת כל אחד (מרובת threads),
+    Jaccard מחושב רק לזוגות עם טוקן משותף (אחרת הוא 0), והשילוב נעשה ב-NumPy.
+    """
+    n_g, n_c = len(guest_norms), len(index)
+    if n_g == 0 or n_c == 0:
+        return np.zeros((n_g, n_c), dtype=np.float64)
+
+    g_profiles = [name_profile(g) for g in guest_norms]
+    g_lengths = np.array([p.length for p in g_profiles], dtype=np.int64)
+
+    tr = process.cdist([p.joined for p in g_profiles], index.joined,
+                       scorer=fuzz.token_set_ratio, dtype=np.float64, workers=_CDIST_WORKERS) / 100
+    fr = process.cdist([p.first for p in g_profiles], index.firsts,
+                       scorer=fuzz.ratio, dtype=np.float64, workers=_CDIST_WORKERS) / 100
+
+    # Jaccard - רק לזוגות שחולקים טוקן דומה
+    jr = np.zeros((n_g, n_c), dtype=np.float64)
+    g_unique_tokens = sorted({t for p in g_profiles for t in p.token_set})
+    eq_pairs = _fuzzy_token_pairs(g_unique_tokens, index)
+    related_tokens: Dict[str, List[str]] = {}
+    for gt, ct in eq_pairs:
+        related_tokens.setdefault(gt, []).append(ct)
+    for gi, gp in enumerate(g_profiles):
+        related = set()
+        for t in gp.token_set:
+            for ct in related_tokens.get(t, ()):
+                related.update(index.token_postings[ct])
+        for ci in related:
+            cp = index.profiles[ci]
+            jr[gi, ci] = _fuzzy_jaccard(gp.tokens, cp.tokens, len(gp.token_set), len(cp.token_set), eq_pairs)
+
+    gl, cl = g_lengths[:, None], index.lengths[None, :]
+    gap = np.abs(gl - cl)
+    penalty = np.where(gap >= 2, np.minimum(gl, cl) / np.maximum(np.maximum(gl, cl), 1), 1.0)
+
+    scores = np.rint((0.6 * tr + 0.2 * fr + 0.2 * jr) * penalty * 100)
+
+    # מקרי קצה של full_score: שם ללא טוקנים → partial_ratio
+    g_empty = np.flatnonzero(g_lengths == 0)
+    c_empty = np.flatnonzero(index.lengths == 0)
+    if len(g_empty):
+        scores[g_empty, :] = process.cdist([guest_norms[i] for i in g_empty], index.norms,
+                                           scorer=fuzz.partial_ratio, dtype=np.float64, workers=_CDIST_WORKERS)
+    if len(c_empty):
+        scores[:, c_empty] = process.cdist(guest_norms, [index.norms[i] for i in c_empty],
+                                           scorer=fuzz.partial_ratio, dtype=np.float64, workers=_CDIST_WORKERS)
+
+    # שם זהה / טוקנים זהים → AUTO_SCORE
+    for gi, gp in enumerate(g_profiles):
+        scores[gi, exact_positions(gp, index)] = AUTO_SCORE
+
+    # שם ריק → 0
+    scores[[i for i, g in enumerate(guest_norms) if not g], :] = 0
+    scores[:, [i for i, c in enumerate(index.norms) if not c]] = 0
+    return scores
+
+def exact_positions(gp: NameProfile, index: ContactIndex) -> List[int]:
+    """🔥 hash join: אנשי קשר עם שם מנורמל זהה או רצף טוקנים זהה - ציון AUTO_SCORE ב-O(1)"""
+    hits = index.by_stripped.get(gp.stripped, [])
+    by_tokens = index.by_tokens.get(tuple(gp.tokens), [])
+    if not hits:
+        return list(by_tokens)
+    if not by_tokens:
+        return list(hits)
+    return sorted(set(hits).union(by_tokens))
+
+# ציון של זוג בלי טוקן משותף: (0.6·tr + 0.2·fr)·penalty, ולכן כדי להגיע ל-MIN_SCORE_DISPLAY
+# (אחרי עיגול) נדרש token_set_ratio ≥ 82.5 - עם מרווח ביטחון קטן
+BLOCK_TSR_CUTOFF = int((MIN_SCORE_DISPLAY - 0.5 - 20) / 0.6)
+
+def candidate_positions(gp: NameProfile, index: ContactIndex, neighbours: Optional[Dict[str, Set[str]]] = None) -> Set[int]:
+    """
+    🔥 blocking: אנשי קשר שחולקים עם המוזמן לפחות טוקן אחד דומה (≥ 90 % Levenshtein),
+    דרך אינדקס וריאנטי המחיקה. neighbours: מטמון טוקן → טוקנים דומים בין מוזמנים.
+    """
+    if neighbours is None:
+        neighbours = {}
+    positions: Set[int] = set()
+    for t in gp.token_set:
+        near = neighbours.get(t)
+        if near is None:
+            near = {
+                ct
+                for v in _deletion_variants(t)
+                for ct in index.variant_postings.get(v, ())
+                if _fuzzy_eq(t, ct)
+            }
+            neighbours[t] = near
+        for ct in near:
+            positions.update(index.token_postings[ct])
+    return positions
+
+def blocked_scores(guest_norms: List[str], index: ContactIndex) -> np.ndarray:
+    """
+    🔥 ציונים רק לזוגות שעברו blocking - שאר הזוגות מקבלים 0.
+    מועמד = טוקן דומה משותף, או token_set_ratio ≥ BLOCK_TSR_CUTOFF (לשמות בלי טוקן משותף
+    זה ratio על הטוקנים הממוינים - cdist זול), או שם ללא טוקנים (partial_ratio של full_score).
+    כל זוג שמקבל ב-full_score ציון ≥ MIN_SCORE_DISPLAY נשמר עם אותו ציון.
+    """
+    n_g, n_c = len(guest_norms), len(index)
+    scores = np.zeros((n_g, n_c), dtype=np.float64)
+    if n_g == 0 or n_c == 0:
+        return scores
+
+    g_profiles = [name_profile(g) for g in guest_norms]
+    fallback = process.cdist([p.set_joined for p in g_profiles], index.set_joined,
+                             scorer=fuzz.ratio, score_cutoff=BLOCK_TSR_CUTOFF,
+                             dtype=np.float64, workers=_CDIST_WORKERS)
+
+    neighbours: Dict[str, Set[str]] = {}
+    for gi, (g_norm, gp) in enumerate(zip(guest_norms, g_profiles)):
+        if not g_norm:
+            continue
+        if not gp.tokens:
+            scores[gi] = _score_guest(g_norm, index)
+            continue
+        cands = candidate_positions(gp, index, neighbours)
+        cands.update(np.flatnonzero(fallback[gi]).tolist())
+        cands = np.fromiter(cands, dtype=np.int64, count=len(cands))
+
+        # קנס פער אורכים לבדו מוריד מתחת לסף → אין צורך בציון מלא
+        lc = index.lengths[cands]
+        ratio = np.minimum(lc, gp.length) / np.maximum(lc, gp.length)
+        keep = (np.abs(lc - gp.length) < 2) | (ratio * 100 >= MIN_SCORE_DISPLAY - 0.5)
+        cands = np.concatenate([cands[keep], index.empty_positions]).astype(np.int64)
+
+        for ci in cands.tolist():
+            scores[gi, ci] = _score_profiles(g_norm, gp, index.norms[ci], index.profiles[ci])
+    return scores
+
+def _iter_score_rows(guest_norms: List[str], index: ContactIndex):
+    """
+    מחזיר שורת ציונים לכל מוזמן, לפי MATCH_SCORING:
+    blocked (ברירת מחדל) / batch (מטריצה מלאה) - במנות של MATCH_BATCH_ROWS, או pairwise (זוג-זוג)
+    """
+    if MATCH_SCORING == "pairwise":
+        for g in guest_norms:
+            yield _score_guest(g, index) if g else None
+        return
+    scorer = score_matrix if MATCH_SCORING == "batch" else blocked_scores
+    for start in range(0, len(guest_norms), MATCH_BATCH_ROWS):
+        block = scorer(guest_norms[start:start + MATCH_BATCH_ROWS], index)
+        for row in block:
+            yield row
+
+def _exact_match(guest_norm: str, contacts_df: pd.DataFrame, index: ContactIndex,
+                 positions: List[int], neighbours: Dict[str, Set[str]]) -> tuple[int, pd.DataFrame]:
+    """
+    תוצאה למוזמן שנפתר ב-hash join: עד 3 מועמדים עם ציון ≥ 90, כמו match_guest עם best_score 100.
+    בלי טוקן דומה משותף הציון ≤ 80 (jr = 0), ולכן מספיק לחשב ציון רק ל-candidate_positions
+    ולאנשי קשר ללא טוקנים (partial_ratio)
+    """
+    gp = name_profile(guest_norm)
+    scores: Dict[int, int] = {u: AUTO_SCORE for u in positions}
+    for u in candidate_positions(gp, index, neighbours).union(index.empty_positions):
+        if u not in scores:
+            score = _score_profiles(guest_norm, gp, index.norms[u], index.profiles[u])
+            if score >= 90:
+                scores[u] = score
+    picked = sorted(index.expand(scores), key=lambda r: (-scores[index.rows[r]], index.names[r]))[:3]
+    return AUTO_SCORE, _candidates_frame(guest_norm, contacts_df, index, scores, picked)
+
+def iter_guest_matches(guest_norms: List[str], contacts_df: pd.DataFrame, index: ContactIndex):
+    """
+    🔥 צינור ההתאמה: מחזיר (best_score, candidates) לכל מוזמן, לפי הסדר.
+    שלב 1 - hash join מדויק (EXACT_MATCH_STAGE): מוזמנים עם איש קשר זהה מקבלים 100 מיד,
+    והחלופות ≥ 90 נבחרות מתוך ה-blocking בלבד (_exact_match).
+    שלב 2 - רק שאר המוזמנים עוברים למנוע ה-fuzzy (_iter_score_rows).
+    מוזמן בלי טוקנים (רק מילים גנריות) תמיד עובר ל-fuzzy - שם הציון הוא partial_ratio מול כולם.
+    """
+    exact: List[List[int]] = [
+        exact_positions(gp, index) if (g and EXACT_MATCH_STAGE and gp.tokens) else []
+        for g, gp in ((g, name_profile(g)) for g in guest_norms)
+    ]
+    fuzzy_matches = _iter_fuzzy_matches([g for g, e in zip(guest_norms, exact) if not e], contacts_df, index)
+
+    neighbours: Dict[str, Set[str]] = {}
+    for g_norm, positions in zip(guest_norms, exact):
+        if positions:
+            yield _exact_match(g_norm, contacts_df, index, positions, neighbours)
+        else:
+            yield next(fuzzy_matches)
+
+# ───────── התאמה מקבילית (process pool) ─────────
+# אינדקסים משותפים ל-workers: נרשמים לפני ה-fork ועוברים בירושה (copy-on-write), ללא pickle לכל משימה.
+# מפתח ייחודי לכל ריצה - אותו ContactIndex (ממטמון) יכול לשמש כמה מיזוגים במקביל
+_SHARED_MATCH_STATE: Dict[int, tuple] = {}
+_match_tokens = itertools.count()
+
+def _init_match_worker():
+    """רץ פעם אחת בכל worker: cdist חד-threadי, כדי ש-MATCH_WORKERS תהליכים לא יתחרו על הליבות"""
+    global _CDIST_WORKERS
+    _CDIST_WORKERS = 1
+
+def _match_shard(task: tuple) -> List[tuple]:
+    """רץ ב-worker: מחשב התאמות לרסיס של מוזמנים מול האינדקס שעבר בירושה"""
+    token, guest_norms = task
+    contacts_df, index = _SHARED_MATCH_STATE[token]
+    return [
+        match_guest(g_norm, contacts_df, index, row)
+        for g_norm, row in zip(guest_norms, _iter_score_rows(guest_norms, index))
+    ]
+
+def _use_process_pool(n_guests: int) -> bool:
+    """מצב מקבילי - רק אם הופעל (MATCH_WORKERS > 1), מעל סף הגודל, ורק כש-fork זמין"""
+    return (
+        MATCH_WORKERS > 1
+        and n_guests >= PARALLEL_MIN_GUESTS
+        and "fork" in multiprocessing.get_all_start_methods()
+    )
+
+def _iter_fuzzy_matches(guest_norms: List[str], contacts_df: pd.DataFrame, index: ContactIndex):
+    """התאמות fuzzy לפי הסדר - ברצף, או מפוצל בין ליבות ב-ProcessPoolExecutor"""
+    if not _use_process_pool(len(guest_norms)):
+        for g_norm, row in zip(guest_norms, _iter_score_rows(guest_norms, index)):
+            yield match_guest(g_norm, contacts_df, index, row)
+        return
+
+    token = next(_match_tokens)
+    _SHARED_MATCH_STATE[token] = (contacts_df, index)
+    try:
+        shard_size = max(1, -(-len(guest_norms) // (MATCH_WORKERS * 4)))
+        tasks = [(token, guest_norms[i:i + shard_size]) for i in range(0, len(guest_norms), shard_size)]
+        print(f"⚡ Matching {len(guest_norms)} guests on {MATCH_WORKERS} workers ({len(tasks)} shards)")
+        with ProcessPoolExecutor(max_workers=MATCH_WORKERS,
+                                 mp_context=multiprocessing.get_context("fork"),
+                                 initializer=_init_match_worker) as pool:
+            # map שומר על סדר הרסיסים → אותו סדר מוזמנים כמו בריצה רציפה
+            for shard_results in pool.map(_match_shard, tasks):
+                yield from shard_results
+    finally:
+        _SHARED_MATCH_STATE.pop(token, None)
+
+def top_matches(guest_norm: str, contacts_df: pd.DataFrame, limit_to_three: bool = False,
+                index: Optional[ContactIndex] = None) -> pd.DataFrame:
     """בחירת מועמדים"""
     if not guest_norm:
         return pd.DataFrame(columns=list(contacts_df.columns) + ["score", "reason"])
 
-    scores = contacts_df["norm_name"].apply(lambda c: full_score(guest_norm, c))
-    df = contacts_df.assign(score=scores)
-    max_score = int(df["score"].max())
-    
-    if limit_to_three and max_score >= AUTO_SELECT_TH:
-        candidates = (
-            df[df["score"] >= 90]
-            .sort_values(["score", NAME_COL], ascending=[False, True])
-            .head(3)
-            .copy()
-        )
-    elif max_score == AUTO_SCORE:
-        candidates = (
-            df[df["score"] >= 90]
-            .sort_values(["score", NAME_COL], ascending=[False, True])
-            .head(3)
-            .copy()
-        )
-    else:
-        candidates = (
-            df[df["score"] >= MIN_SCORE_DISPLAY]
-            .sort_values(["score", NAME_COL], ascending=[False, True])
-            .head(MAX_DISPLAYED)
-            .copy()
-        )
+    if index is None:
+        index = build_contact_index(contacts_df)
+    scores = _score_guest(guest_norm, index)
+    max_score = int(max(scores))
 
-    if len(candidates) > 0:
-        reason_series = candidates.apply(
-            lambda row: reason_for(guest_norm, row["norm_name"], row["score"]),
-            axis=1
-        )
-        candidates = candidates.copy()
-        candidates["reason"] = reason_series
+    positions = _pick_positions(scores, index, max_score, limit_to_three)
+    return _candidates_frame(guest_norm, contacts_df, index, scores, positions)
 
-    return candidates
+def match_guest(guest_norm: str, contacts_df: pd.DataFrame,
+                index: Optional[ContactIndex] = None,
+                scores: Optional[np.ndarray] = None) -> tuple[int, pd.DataFrame]:
+    """
+    🔥 מנוע התאמה במעבר יחיד: כל זוג מוזמן/איש קשר מקבל ציון פעם אחת.
+    מחזיר (best_score, candidates) - זהה ל-compute_best_scores + top_matches.
+    scores: שורת ציונים מחושבת מראש (למשל מ-score_matrix)
+    """
+    if not guest_norm:
+        return 0, top_matches(guest_norm, contacts_df)
+
+    if index is None:
+        index = build_contact_index(contacts_df)
+    if scores is None:
+        scores = _score_guest(guest_norm, index)
+    max_score = int(max(scores))
+
+    # best_score הוא הציון הגבוה מבין המועמדים המוצגים (0 אם אין מועמד מעל הסף)
+    best_score = max_score if max_score >= MIN_SCORE_DISPLAY else 0
+    limit_to_three = best_score >= AUTO_SELECT_TH
+
+    positions = _pick_positions(scores, index, max_score, limit_to_three)
+    return best_score, _candidates_frame(guest_norm, contacts_df, index, scores, positions)
 
 def extract_smart_fields(guest_details: dict) -> dict:
     """🔥 חילוץ חכם של שדות לפי סדר עדיפות"""
@@ -515,91 +1154,122 @@ def extract_relevant_guest_details(row: pd.Series) -> Dict:
 
 def compute_best_scores(guests_df: pd.DataFrame, contacts_df: pd.DataFrame) -> pd.DataFrame:
     """מחשב ציונים"""
-    best_scores = []
-    for _, guest_row in guests_df.iterrows():
-        matches = top_matches(guest_row["norm_name"], contacts_df)
-        best_score = int(matches["score"].max()) if len(matches) > 0 else 0
-        best_scores.append(best_score)
+    index = build_contact_index(contacts_df)
+    best_scores = [
+        best_score
+        for best_score, _ in iter_guest_matches(guests_df["norm_name"].tolist(), contacts_df, index)
+    ]
     
     guests_df = guests_df.copy()
     guests_df["best_score"] = best_scores
     return guests_df
 
-def process_matching_results(guests_df: pd.DataFrame, contacts_df: pd.DataFrame, contacts_source: str = "file") -> List[Dict]:
-    """עיבוד מלא"""
-    results = []
-    guests_with_scores = compute_best_scores(guests_df, contacts_df)
-    
-    perfect_matches = []
-    auto_matches = []
-    good_matches = []
-    weak_matches = []
+def result_tier(best_score: int) -> str:
+    """שכבת תוצאה: perfect / auto / good / weak"""
+    if best_score == 100:
+        return "perfect"
+    elif best_score >= AUTO_SELECT_TH:
+        return "auto"
+    elif best_score >= 70:
+        return "good"
+    return "weak"
+
+def iter_matching_results(guests_df: pd.DataFrame, contacts_df: pd.DataFrame, contacts_source: str = "file",
+                          index: Optional[ContactIndex] = None, match_memo: Optional[Dict[str, Dict]] = None):
+    """
+    🔥 מחזיר את התוצאה של כל מוזמן ברגע שחושבה, לפי סדר הקובץ (בסיס ל-streaming).
+    index: אינדקס אנשי קשר מוכן (למשל ממטמון) - אחרת נבנה כאן
+    match_memo: norm_name → התאמה מריצה קודמת מול אותם אנשי קשר (מצב אינקרמנטלי).
+    רק שורות ששמן חדש/השתנה עוברות ציון; בסוף הריצה ה-memo מכיל בדיוק את שמות הקובץ הנוכחי.
+    """
+    if index is None:
+        index = build_contact_index(contacts_df)
+    guest_norms = guests_df["norm_name"].tolist()
+    if match_memo is None:
+        match_memo = {}
+    # כל שם חדש נשלח לציון פעם אחת, לפי סדר ההופעה הראשונה (כך נצרך ה-generator בלולאה)
+    changed = list(dict.fromkeys(g for g in guest_norms if g not in match_memo))
+    if match_memo:
+        print(f"♻️ Incremental match: {len(changed)}/{len(guest_norms)} guests re-scored")
+    guest_matches = iter_guest_matches(changed, contacts_df, index)
     
-    for _, guest_row in guests_with_scores.iterrows():
-        guest_name = guest_row[NAME_COL]
-        guest_norm = guest_row["norm_name"]
-        best_score = guest_row["best_score"]
-        
-        limit_to_three = best_score >= AUTO_SELECT_TH
-        matches = top_matches(guest_norm, contacts_df, limit_to_three=limit_to_three)
-        
-        phone_map = {}
-        for _, match_row in matches.iterrows():
-            phone = format_phone(match_row[PHONE_COL])
-            score = int(match_row["score"])
-            name = match_row[NAME_COL]
-            reason = match_row.get("reason", "")
-            
-            if phone not in phone_map:
-                phone_map[phone] = {
-                    "names": [name],
-                    "phone": phone,
-                    "score": score,
-                    "reason": reason
-                }
-            else:
-                phone_map[phone]["names"].append(name)
-                if score > phone_map[phone]["score"]:
-                    phone_map[phone]["score"] = score
-                    phone_map[phone]["reason"] = reason
-        
-        candidates = []
-        for phone, data in phone_map.items():
-            candidate = {
-                "name": " / ".join(data["names"]),
-                "phone": phone,
-                "score": data["score"],
-                "reason": data["reason"]
-            }
-            candidates.append(candidate)
-        
-        candidates.sort(key=lambda x: x["score"], reverse=True)
-        
-        auto_selected = None
-        if candidates and candidates[0]["score"] >= AUTO_SELECT_TH:
-            auto_selected = candidates[0]
+    for (_, guest_row), g_norm in zip(guests_df.iterrows(), guest_norms):
+        match = match_memo.get(g_norm)
+        if match is None:
+            match = _match_payload(*next(guest_matches))
+            match_memo[g_norm] = match
         
         raw_details = extract_relevant_guest_details(guest_row)
         guest_details = raw_details #  כל השדות נשלחים 
         
-        result = {
-            "guest": guest_name,
+        yield {
+            "guest": guest_row[NAME_COL],
             "guest_details": guest_details,
-            "candidates": candidates,
-            "best_score": best_score,
-            "auto_selected": auto_selected
+            "candidates": match["candidates"],
+            "best_score": match["best_score"],
+            "auto_selected": match["auto_selected"]
         }
+
+    # שמות שכבר לא בקובץ יוצאים מה-memo
+    current = set(guest_norms)
+    for g_norm in [g for g in match_memo if g not in current]:
+        del match_memo[g_norm]
+
+def _match_payload(best_score: int, matches: pd.DataFrame) -> Dict:
+    """מועמדים מאוחדים לפי טלפון + בחירה אוטומטית - החלק בתוצאה שתלוי רק בשם"""
+    phone_map = {}
+    for _, match_row in matches.iterrows():
+        phone = format_phone(match_row[PHONE_COL])
+        score = int(match_row["score"])
+        name = match_row[NAME_COL]
+        reason = match_row.get("reason", "")
         
-        if best_score == 100:
-            perfect_matches.append(result)
-        elif best_score >= AUTO_SELECT_TH:
-            auto_matches.append(result)
-        elif best_score >= 70:
-            good_matches.append(result)
+        if phone not in phone_map:
+            phone_map[phone] = {
+                "names": [name],
+                "phone": phone,
+                "score": score,
+                "reason": reason
+            }
         else:
-            weak_matches.append(result)
+            phone_map[phone]["names"].append(name)
+            if score > phone_map[phone]["score"]:
+                phone_map[phone]["score"] = score
+                phone_map[phone]["reason"] = reason
+    
+    candidates = []
+    for phone, data in phone_map.items():
+        candidate = {
+            "name": " / ".join(data["names"]),
+            "phone": phone,
+            "score": data["score"],
+            "reason": data["reason"]
+        }
+        candidates.append(candidate)
+    
+    candidates.sort(key=lambda x: x["score"], reverse=True)
     
-    sorted_results = perfect_matches[:30] + auto_matches + good_matches + weak_matches
+    auto_selected = None
+    if candidates and candidates[0]["score"] >= AUTO_SELECT_TH:
+        auto_selected = candidates[0]
+    
+    return {"best_score": best_score, "candidates": candidates, "auto_selected": auto_selected}
+
+def process_matching_results(guests_df: pd.DataFrame, contacts_df: pd.DataFrame, contacts_source: str = "file",
+                             progress: Optional[Callable[[int, int], None]] = None,
+                             index: Optional[ContactIndex] = None,
+                             match_memo: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+    """עיבוד מלא. progress(scored, total) נקרא אחרי כל מוזמן"""
+    tiers = {"perfect": [], "auto": [], "good": [], "weak": []}
+    
+    total = len(guests_df)
+    results = iter_matching_results(guests_df, contacts_df, contacts_source, index, match_memo)
+    for scored, result in enumerate(results, 1):
+        tiers[result_tier(result["best_score"])].append(result)
+        if progress:
+            progress(scored, total)
+    
+    sorted_results = tiers["perfect"][:MAX_PERFECT_RESULTS] + tiers["auto"] + tiers["good"] + tiers["weak"]
     return sorted_results
 
 def validate_dataframes(guests_df: pd.DataFrame, contacts_df: pd.DataFrame) -> tuple[bool, str]:
@@ -620,8 +1290,158 @@ def validate_dataframes(guests_df: pd.DataFrame, contacts_df: pd.DataFrame) -> t
         return False, "שגיאת עיבוד"
     return True, "OK"
 
+# ───────── סריקת עמודת טלפון (בלי לקרוא את כל הקובץ) ─────────
+PHONE_SCAN_CHUNK_BYTES = 4 * 1024 * 1024
+_SCAN_CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+# הסריקה מניחה r="..." כמאפיין הראשון של כל תא (Excel / LibreOffice / openpyxl) - אחרת קריאה מלאה
+_CELL_WITHOUT_LEADING_REF_RE = re.compile(rb'<c(?:/?>|\s(?!r=")[^>]*>)')
+_TYPE_ATTR_RE = re.compile(rb'\bt="(\w+)"')
+_VALUE_RE = re.compile(rb'<v\b[^>]*?(?:/>|>(.*?)</v>)', re.S)
+_INLINE_TEXT_RE = re.compile(rb'<t\b[^>]*?(?:/>|>(.*?)</t>)', re.S)
+_PHONETIC_RE = re.compile(rb'<rPh\b.*?</rPh>', re.S)
+
+def _xml_text(raw: bytes) -> str:
+    text = raw.decode("utf-8")
+    return html.unescape(text) if "&" in text else text
+
+def _xml_cell_value(attrs: bytes, body: Optional[bytes], shared_strings: list):
+    """ערך תא מה-XML כמו ש-openpyxl קורא אותו (data_only): None = אין ערך, שגיאה = NaN, מספר = הטקסט שלו"""
+    if not body:
+        return None
+    t = _TYPE_ATTR_RE.search(attrs)
+    data_type = t.group(1) if t else b"n"
+    if data_type == b"inlineStr":
+        if b"<is" not in body:
+            return None
+        body = _PHONETIC_RE.sub(b"", body) if b"<rPh" in body else body
+        return _xml_text(b"".join(m.group(1) or b"" for m in _INLINE_TEXT_RE.finditer(body)))
+    v = _VALUE_RE.search(body)
+    if v is None or not v.group(1):
+        return None
+    if data_type == b"s":
+        return shared_strings[int(v.group(1))]
+    if data_type == b"e":
+        return np.nan
+    return _xml_text(v.group(1))
+
+def _is_filled_value(value) -> bool:
+    """אותו תנאי כמו fillna('').astype(str).str.strip() != '' אחרי pd.read_excel"""
+    if value is None or _is_empty_cell(value):
+        return False
+    return not isinstance(value, str) or value.strip() != ""
+
+def _iter_sheet_blocks(zf: zipfile.ZipFile, sheet_path: str) -> Iterator[bytes]:
+    """
+    ה-XML של הגיליון בזרימה, בבלוקים של ~PHONE_SCAN_CHUNK_BYTES שנחתכים על גבול </row>.
+    ValueError לגיליון עם prefix ל-namespace (<x:row>) או כשאין </row> בשני בלוקים - אחרת הכל נצבר בזיכרון
+    """
+    pending = b""
+    first = True
+    with zf.open(sheet_path) as src:
+        while True:
+            chunk = src.read(PHONE_SCAN_CHUNK_BYTES)
+            if first and _PREFIXED_SHEET_RE.search(chunk):
+                raise ValueError("sheet XML uses a namespace prefix")
+            first = False
+            block = pending + chunk
+            if not block:
+                return
+            cut = block.rfind(b"</row>") + len(b"</row>") if chunk else len(block)
+            if cut < len(b"</row>"):
+                if len(block) >= 2 * PHONE_SCAN_CHUNK_BYTES:
+                    raise ValueError("no </row> in sheet XML")
+                pending = block
+                continue
+            block, pending = block[:cut], block[cut:]
+            if _CELL_WITHOUT_LEADING_REF_RE.search(block):
+                raise ValueError("cell without leading reference")
+            yield block
+            if not chunk:
+                return
+
+def _last_data_row(block: bytes, shared_strings: list) -> int:
+    """מספר השורה האחרונה בבלוק שיש בה ערך כלשהו (שורות ריקות בסוף נחתכות ב-read_excel), 0 אם אין"""
+    end = len(block)
+    while True:
+        start = block.rfind(b"<row", 0, end)
+        if start < 0:
+            return 0
+        row = _ROW_RE.match(block, start)
+        ref = _REF_ATTR_RE.search(row.group(1)) if row else None
+        if ref is None:
+            raise ValueError("row without reference")
+        if any(_xml_cell_value(m.group(1), m.group(2), shared_strings) not in (None, "")
+               for m in _SCAN_CELL_RE.finditer(row.group(3) or b"")):
+            return int(ref.group(2))
+        end = start
+
+def scan_phone_column(file) -> Optional[dict]:
+    """
+    🔥 check-phone-column בלי לטעון את כל הקובץ:
+    כותרת + STREAM_SAMPLE_ROWS שורות (pd.read_excel עם nrows) → זיהוי העמודה עם detect_column_type,
+    ואז מעבר בזרימה על ה-XML של הגיליון וספירת התאים המלאים בעמודה הזו בלבד.
+    התוצאה זהה ל-check_existing_phone_column על הקובץ המלא; None = אי אפשר לסרוק (csv / xls) → קריאה מלאה
+    """
+    if hasattr(file, "filename") and str(file.filename).lower().endswith(".csv"):
+        return None
+    start = file.tell()
+    if not zipfile.is_zipfile(file):
+        file.seek(start)
+        return None
+    file.seek(start)
+
+    try:
+        sample = read_table(file, nrows=STREAM_SAMPLE_ROWS)
+        # גיליון של עמודה אחת: pandas מדלג שם על שורות ריקות, ומספרי השורות בגיליון לא מתאימים
+        if len(sample.columns) < 2:
+            return None
+        phone_cols = [col for col, type_val in smart_column_mapping(sample).items() if type_val == 'phone']
+        phone_cell_re = None
+        if phone_cols:
+            letter = _col_letter(list(sample.columns).index(phone_cols[0]) + 1).encode()
+            phone_cell_re = re.compile(rb'<c r="%s(\d+)"([^>]*?)(?:/>|>(.*?)</c>)' % letter, re.S)
+
+        file.seek(start)
+        with zipfile.ZipFile(file) as zf:
+            shared_strings = []
+            if "xl/sharedStrings.xml" in zf.namelist():
+                from openpyxl.reader.strings import read_string_table
+                with zf.open("xl/sharedStrings.xml") as src:
+                    shared_strings = read_string_table(src)
+
+            last_row = 1
+            filled = 0
+            saw_rows = False
+            for block in _iter_sheet_blocks(zf, _first_sheet_path(zf)):
+                saw_rows = saw_rows or b"<row" in block
+                last_row = max(last_row, _last_data_row(block, shared_strings))
+                if phone_cell_re is None:
+                    continue
+                for cell in phone_cell_re.finditer(block):
+                    if int(cell.group(1)) >= 2 and _is_filled_value(
+                        _xml_cell_value(cell.group(2), cell.group(3), shared_strings)
+                    ):
+                        filled += 1
+            # הדגימה מצאה שורות אבל ה-XML לא (namespace אחר) - תשובה שגויה גרועה מקריאה מלאה
+            if len(sample) and not saw_rows:
+                raise ValueError("no <row> elements in sheet XML")
+    except Exception as e:
+        print(f"⚠️ Phone column scan not possible ({e}) - reading full file")
+        return None
+    finally:
+        file.seek(start)
+
+    total_rows = last_row - 1
+    return {
+        'has_phone_column': bool(phone_cols),
+        'phone_column_name': phone_cols[0] if phone_cols else None,
+        'filled_count': filled,
+        'empty_count': total_rows - filled,
+        'total_rows': total_rows
+    }
+
 # 🔥 בדיקה אם יש עמודת טלפון קיימת
-def check_existing_phone_column(file) -> dict:
+def check_existing_phone_column(file, parsed: Optional[ExportFrame] = None) -> dict:
     """
     🔥 בודק אם יש עמודת טלפון בקובץ
     מחזיר: {
@@ -632,18 +1452,12 @@ def check_existing_phone_column(file) -> dict:
     }
     """
     try:
-        if hasattr(file, "filename") and str(file.filename).lower().endswith(".csv"):
-            df = pd.read_csv(file, encoding='utf-8')
-        else:
-            df = pd.read_excel(file)
-        
-        df.columns = [str(col).strip() for col in df.columns]
-        
-        column_mapping = smart_column_mapping(df)
-        phone_cols = [col for col, type_val in column_mapping.items() if type_val == 'phone']
+        if parsed is None:
+            parsed = parse_workbook(file)
+        df = parsed.df
         
-        if phone_cols:
-            phone_col = phone_cols[0]
+        if parsed.phone_col:
+            phone_col = parsed.phone_col
             phone_data = df[phone_col].fillna('').astype(str)
             filled = (phone_data.str.strip() != '').sum()
             empty = len(phone_data) - filled
@@ -675,74 +1489,406 @@ def check_existing_phone_column(file) -> dict:
         }
 
 # 🔥 ייצוא חכם - כל הקובץ המקורי
-def export_with_original_structure(original_file, selected_contacts: dict, skip_filled: bool = False) -> BytesIO:
+@dataclass
+class ExportFrame:
+    """
+    🔥 קובץ המוזמנים המקורי כפי שנקרא + עמודות שזוהו.
+    מפוענח פעם אחת לכל העלאה ומשותף ל-check-phone-column, merge וייצוא
+    """
+    df: pd.DataFrame
+    names: np.ndarray               # שם מלא לכל שורה (_resolve_full_name_series)
+    phone_col: Optional[str]        # עמודת טלפון קיימת, או None → תיווצר עמודה חדשה
+    column_mapping: Dict[str, str] = field(default_factory=dict)  # smart_column_mapping
+
+    def nbytes(self) -> int:
+        return int(self.df.memory_usage(deep=True).sum()) + len(self.names) * 64
+
+def prepare_export_frame(df: pd.DataFrame) -> ExportFrame:
+    """זיהוי עמודת השם ועמודת הטלפון פעם אחת, על הקובץ המקורי המלא"""
+    print(f"📊 Original file has {len(df)} rows")
+    column_mapping = smart_column_mapping(df)
+    phone_cols = [col for col, type_val in column_mapping.items() if type_val == 'phone']
+    return ExportFrame(
+        df=df,
+        names=_resolve_full_name_series(df).to_numpy(dtype=object),
+        phone_col=phone_cols[0] if phone_cols else None,
+        column_mapping=column_mapping,
+    )
+
+def parse_workbook(file) -> ExportFrame:
+    """קריאה + זיהוי עמודות של קובץ מוזמנים"""
+    return prepare_export_frame(read_table(file))
+
+NEW_PHONE_COL = "מספר פלאפון"
+
+def _phone_by_name(selected_contacts: dict) -> Dict[str, str]:
+    return {
+        name: contact.get('phone', '')
+        for name, contact in selected_contacts.items()
+        if not contact.get('isNotFound') and contact.get('phone', '')
+    }
+
+def _export_fill_plan(frame: ExportFrame, selected_contacts: dict, skip_filled: bool):
+    """
+    אילו שורות למלא ובאיזה טלפון: מפת שם → טלפון + מסכת skip_filled (וקטורי).
+    מחזיר (fill_mask, new_phones, skipped_count) לפי מיקום השורה בקובץ
+    """
+    phone_by_name = _phone_by_name(selected_contacts)
+    new_phones = pd.Series(frame.names).map(phone_by_name)
+    fill_mask = new_phones.notna().to_numpy()
+
+    skipped_count = 0
+    if skip_filled and frame.phone_col:
+        current = frame.df[frame.phone_col]
+        current_text = current.astype(str).str.strip()
+        has_existing_phone = (
+            current.notna() & (current_text != '') & (current_text.str.lower() != 'nan')
+        ).to_numpy()
+        skipped_count = int(has_existing_phone.sum())
+        fill_mask = fill_mask & ~has_existing_phone
+
+    print(f"✅ Filled {int(fill_mask.sum())} phones")
+    if skip_filled:
+        print(f"⏭️ Skipped {skipped_count} rows (already had phone)")
+    return fill_mask, new_phones.to_numpy(dtype=object), skipped_count
+
+def fill_export_phones(frame: ExportFrame, selected_contacts: dict, skip_filled: bool = False) -> pd.DataFrame:
+    """
+    מילוי עמודת הטלפון בפעולה וקטורית אחת.
+    מחזיר עותק - ה-ExportFrame נשאר נקי לייצוא הבא
+    """
+    df = frame.df.copy()
+    if frame.phone_col:
+        phone_col_name = frame.phone_col
+        print(f"📞 Found existing phone column: {phone_col_name}")
+        # עמודה ריקה / מספרית נקראת כ-float - צריך object כדי לכתוב טלפון כמחרוזת
+        if df[phone_col_name].dtype.kind not in "OT":
+            df[phone_col_name] = df[phone_col_name].astype(object)
+    else:
+        phone_col_name = NEW_PHONE_COL
+        df[phone_col_name] = ""
+        print(f"➕ Created new phone column: {phone_col_name}")
+
+    fill_mask, new_phones, _ = _export_fill_plan(frame, selected_contacts, skip_filled)
+    df.loc[fill_mask, phone_col_name] = new_phones[fill_mask]
+    return df
+
+# ───────── ייצוא בתיקון XML ─────────
+_XLSX_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_XLSX_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_ROW_RE = re.compile(rb'<row\b([^>]*?)(/>|>(.*?)</row>)', re.S)
+_CELL_RE = re.compile(rb'<c\b([^>]*?)(?:/>|>.*?</c>)', re.S)
+# sheetData עם prefix (<x:sheetData>) - הביטויים כאן מכירים רק את ה-namespace הראשי בלי prefix
+_PREFIXED_SHEET_RE = re.compile(rb'<[A-Za-z_][\w.-]*:sheetData\b')
+_REF_ATTR_RE = re.compile(rb'\br="([A-Z]+)?(\d+)"')
+_STYLE_ATTR_RE = re.compile(rb'\bs="(\d+)"')
+
+def _col_letter(idx: int) -> str:
+    """1 → A, 27 → AA"""
+    letters = ""
+    while idx:
+        idx, rem = divmod(idx - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def _col_index(letters: bytes) -> int:
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + ch - 64
+    return idx
+
+def _first_sheet_path(zf: zipfile.ZipFile) -> str:
+    """נתיב ה-XML של הגיליון הראשון (זה ש-pd.read_excel קורא)"""
+    import xml.etree.ElementTree as ET
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    rel_id = workbook.find(f"{_XLSX_MAIN_NS}sheets")[0].attrib[f"{_XLSX_REL_NS}id"]
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    target = next(r.attrib["Target"] for r in rels.iter(f"{_XLSX_PKG_REL_NS}Relationship") if r.attrib["Id"] == rel_id)
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+def _patch_row(attrs: bytes, cells: bytes, row_num: int, col_idx: int, value: str) -> bytes:
+    """מחליף / מוסיף את תא העמודה col_idx בשורה, ושומר על סדר התאים ועל העיצוב הקיים"""
+    col = _col_letter(col_idx)
+    text = value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    style = b""
+    insert_at = len(cells)
+    replace_end = None
+    for m in _CELL_RE.finditer(cells):
+        ref = _REF_ATTR_RE.search(m.group(1))
+        if ref is None or ref.group(1) is None:
+            raise ValueError("cell without reference")
+        cell_idx = _col_index(ref.group(1))
+        if cell_idx == col_idx:
+            insert_at, replace_end = m.start(), m.end()
+            s = _STYLE_ATTR_RE.search(m.group(1))
+            style = b' s="%s"' % s.group(1) if s else b""
+            break
+        if cell_idx > col_idx:
+            insert_at = m.start()
+            break
+    new_cell = b'<c r="%s%d"%s t="inlineStr"><is><t>%s</t></is></c>' % (
+        col.encode(), row_num, style, text.encode("utf-8")
+    )
+    cells = cells[:insert_at] + new_cell + cells[replace_end if replace_end is not None else insert_at:]
+    # spans הוא רמז אופציונלי - מוסר כדי שלא יסתור את התא שנוסף
+    attrs = re.sub(rb'\sspans="[^"]*"', b"", attrs)
+    return b"<row%s>%s</row>" % (attrs, cells)
+
+def _patch_rows(block: bytes, row_values: Dict[int, str], col_idx: int) -> tuple[bytes, int]:
+    """כותב ערכים לתאי עמודה אחת בשורות שנבחרו בבלוק של XML; מחזיר (בלוק, מספר השורות שתוקנו)"""
+    patched_rows = 0
+
+    def patch(m):
+        nonlocal patched_rows
+        ref = _REF_ATTR_RE.search(m.group(1))
+        if ref is None:
+            raise ValueError("row without reference")
+        row_num = int(ref.group(2))
+        if row_num not in row_values:
+            return m.group(0)
+        patched_rows += 1
+        return _patch_row(m.group(1), m.group(3) or b"", row_num, col_idx, row_values[row_num])
+
+    return _ROW_RE.sub(patch, block), patched_rows
+
+def _widen_dimension(block: bytes, col_idx: int) -> bytes:
+    """הרחבת dimension אם נוספה עמודה מימין"""
+    def widen(m):
+        last_col = m.group(2)
+        if _col_index(last_col) >= col_idx:
+            return m.group(0)
+        return b'<dimension ref="%s:%s%s"' % (m.group(1), _col_letter(col_idx).encode(), m.group(3))
+    return re.sub(rb'<dimension ref="([A-Z]+\d+):([A-Z]+)(\d+)"', widen, block, count=1)
+
+def _iter_patched_sheet(zf: zipfile.ZipFile, sheet_path: str, row_values: Dict[int, str],
+                        col_idx: int) -> Iterator[bytes]:
+    """
+    ה-XML של הגיליון בזרימה (_iter_sheet_blocks) עם תאי הטלפון כתובים; שאר ה-XML מועתק כמו שהוא.
+    ValueError אם לא כל השורות תוקנו (למשל גיליון עם prefix ל-namespace: <x:row>)
+    """
+    patched_rows = 0
+    first = True
+    for block in _iter_sheet_blocks(zf, sheet_path):
+        block, count = _patch_rows(block, row_values, col_idx)
+        patched_rows += count
+        if first:
+            block = _widen_dimension(block, col_idx)
+            first = False
+        yield block
+    if patched_rows != len(row_values):
+        raise ValueError(f"patched {patched_rows} of {len(row_values)} rows")
+
+_TEXT_CELL_TYPES = (b"s", b"inlineStr", b"str")
+
+def _scan_cell(attrs: bytes, body: Optional[bytes], shared_strings: list) -> tuple:
+    """(ערך, האם טקסט) כמו אחרי pd.read_excel - None = NaN (ריק / שגיאה / 'N/A' וכו')"""
+    value = _xml_cell_value(attrs, body, shared_strings)
+    if value is None or _is_empty_cell(value):
+        return None, True
+    t = _TYPE_ATTR_RE.search(attrs)
+    return value, t is not None and t.group(1) in _TEXT_CELL_TYPES
+
+def _looks_converted(values) -> bool:
+    """עמודת טקסט שכולה מספרים / true-false - pandas ממיר אותה, והטקסט אחרי astype(str) כבר לא זהה"""
+    def convertible(v: str) -> bool:
+        if v.strip().lower() in ("true", "false"):
+            return True
+        try:
+            float(v)
+            return True
+        except ValueError:
+            return False
+    present = [v for v in values if v is not None]
+    return bool(present) and all(convertible(v) for v in present)
+
+def scan_export_fill_plan(file_bytes: bytes, selected_contacts: dict, skip_filled: bool) -> Optional[dict]:
+    """
+    🔥 תוכנית המילוי של export_patched_workbook בלי pd.read_excel מלא (כמו scan_phone_column):
+    כותרת + STREAM_SAMPLE_ROWS שורות → עמודות השם והטלפון (אותו זיהוי כמו parse_workbook),
+    ואז מעבר בזרימה על ה-XML ואיסוף התאים של העמודות האלה בלבד.
+    התוכנית זהה ל-_export_fill_plan על הקובץ המלא; None = אי אפשר לסרוק (csv / xls / שם לא-טקסטואלי /
+    נתונים מעבר לכותרת) → ייצוא דרך ה-DataFrame
+    """
+    file = BytesIO(file_bytes)
+    if not zipfile.is_zipfile(file):
+        return None
+    phone_by_name = _phone_by_name(selected_contacts)
+
+    try:
+        file.seek(0)
+        sample = read_table(file, nrows=STREAM_SAMPLE_ROWS)
+        columns = list(sample.columns)
+        # גיליון של עמודה אחת: pandas מדלג שם על שורות ריקות, ומספרי השורות בגיליון לא מתאימים
+        if len(columns) < 2:
+            return None
+        # שם ריק במפה ממלא גם שורות שחסרות ב-XML - נדיר, ולא שווה לשחזר
+        if "" in phone_by_name:
+            return None
+        phone_cols = [col for col, type_val in smart_column_mapping(sample).items() if type_val == 'phone']
+        phone_col = phone_cols[0] if phone_cols else None
+        kind, name_cols = _full_name_columns(columns)
+        wanted = {_col_letter(columns.index(col) + 1).encode(): col for col in name_cols}
+        if phone_col:
+            wanted[_col_letter(columns.index(phone_col) + 1).encode()] = phone_col
+        cell_re = re.compile(
+            rb'<c r="(%s)(\d+)"([^>]*?)(?:/>|>(.*?)</c>)' % b"|".join(wanted), re.S
+        ) if wanted else None
+
+        header_letters = b"|".join(_col_letter(i).encode() for i in range(1, len(columns) + 1))
+        beyond_re = re.compile(rb'<c r="(?!(?:%s)\d)[A-Z]+\d+"([^>]*?)(?:/>|>(.*?)</c>)' % header_letters, re.S)
+        cells: Dict[str, Dict[int, tuple]] = {col: {} for col in wanted.values()}
+        file.seek(0)
+        with zipfile.ZipFile(file) as zf:
+            shared_strings = []
+            if "xl/sharedStrings.xml" in zf.namelist():
+                from openpyxl.reader.strings import read_string_table
+                with zf.open("xl/sharedStrings.xml") as src:
+                    shared_strings = read_string_table(src)
+
+            last_row = 1
+            saw_rows = False
+            for block in _iter_sheet_blocks(zf, _first_sheet_path(zf)):
+                saw_rows = saw_rows or b"<row" in block
+                last_row = max(last_row, _last_data_row(block, shared_strings))
+                # תאים מימין לכותרת מוסיפים ל-DataFrame עמודות Unnamed - משנות את זיהוי השם / מיקום הטלפון
+                for cell in beyond_re.finditer(block):
+                    if _xml_cell_value(cell.group(1), cell.group(2), shared_strings) not in (None, ""):
+                        raise ValueError("data beyond the header columns")
+                if cell_re is None:
+                    continue
+                for cell in cell_re.finditer(block):
+                    row_num = int(cell.group(2))
+                    if row_num >= 2:
+                        cells[wanted[cell.group(1)]][row_num] = _scan_cell(cell.group(3), cell.group(4), shared_strings)
+            if len(sample) and not saw_rows:
+                raise ValueError("no <row> elements in sheet XML")
+    except Exception as e:
+        print(f"⚠️ Export plan scan not possible ({e}) - reading full file")
+        return None
+
+    rows = range(2, last_row + 1)
+    texts = {}
+    for col in name_cols:
+        values = [cells[col].get(r, (None, True)) for r in rows]
+        if not all(is_text for _, is_text in values):
+            print(f"⚠️ Export plan scan not possible (non-text name cells in {col}) - reading full file")
+            return None
+        texts[col] = [v for v, _ in values]
+        if _looks_converted(texts[col]):
+            print(f"⚠️ Export plan scan not possible (numeric name column {col}) - reading full file")
+            return None
+
+    def clean(v: Optional[str]) -> str:
+        return v.strip() if v is not None else ""
+
+    if kind == "first_last":
+        first, last = (texts[col] for col in name_cols)
+        names = [re.sub(r"\s+", " ", clean(f) + " " + clean(l)).strip() for f, l in zip(first, last)]
+    elif kind == "name_like":
+        if not len(rows):
+            return None
+        # כמו astype(str).str.len().mean() - NaN נספר כ-'nan'
+        best_col = max(name_cols, key=lambda col: sum(len(v) if v is not None else 3 for v in texts[col]) / len(rows))
+        names = [clean(v) for v in texts[best_col]]
+    elif name_cols:
+        names = [clean(v) for v in texts[name_cols[0]]]
+    else:
+        names = [""] * len(rows)
+
+    row_values = {}
+    skipped_count = 0
+    for row_num, name in zip(rows, names):
+        phone = phone_by_name.get(name)
+        if skip_filled and phone_col:
+            value, _ = cells[phone_col].get(row_num, (None, True))
+            text = str(value).strip() if value is not None else ""
+            if text != "" and text.lower() != "nan":
+                skipped_count += 1
+                continue
+        if phone is not None:
+            row_values[row_num] = str(phone)
+
+    print(f"✅ Filled {len(row_values)} phones")
+    if skip_filled:
+        print(f"⏭️ Skipped {skipped_count} rows (already had phone)")
+    return {
+        "row_values": row_values,
+        "phone_col": phone_col,
+        "phone_col_idx": columns.index(phone_col) + 1 if phone_col else len(columns) + 1,
+        "skipped": skipped_count,
+    }
+
+def export_patched_workbook(original_bytes: bytes, frame: Optional[ExportFrame], selected_contacts: dict,
+                            skip_filled: bool = False) -> Optional[BytesIO]:
+    """
+    🔥 ייצוא בתיקון במקום: בתוך ה-xlsx המקורי משתנה רק ה-XML של הגיליון הראשון -
+    נכתבים רק תאי הטלפון של השורות שנמצאו (ותא כותרת אם העמודה חדשה). עיצוב, גיליונות ונוסחאות נשמרים,
+    ואין DataFrame / מודל openpyxl בדרך; ה-XML של הגיליון עובר בזרימה, בבלוקים.
+    frame: הקובץ המפוענח אם כבר במטמון; בלעדיו התוכנית נבנית בסריקה (scan_export_fill_plan).
+    שורה i ב-frame = שורה i+2 בגיליון (שורת כותרת אחת - כמו pd.read_excel).
+    מחזיר None אם אי אפשר לתקן (csv / xls / גיליון לא סטנדרטי) - ואז משתמשים בייצוא הרגיל
+    """
+    if not zipfile.is_zipfile(BytesIO(original_bytes)):
+        return None
+
+    if frame is not None:
+        fill_mask, new_phones, _ = _export_fill_plan(frame, selected_contacts, skip_filled)
+        row_values = {int(pos) + 2: str(new_phones[pos]) for pos in np.flatnonzero(fill_mask)}
+        phone_col = frame.phone_col
+        phone_col_idx = list(frame.df.columns).index(phone_col) + 1 if phone_col else len(frame.df.columns) + 1
+    else:
+        plan = scan_export_fill_plan(original_bytes, selected_contacts, skip_filled)
+        if plan is None:
+            return None
+        row_values, phone_col, phone_col_idx = plan["row_values"], plan["phone_col"], plan["phone_col_idx"]
+    filled_count = len(row_values)
+
+    if phone_col:
+        print(f"📞 Found existing phone column: {phone_col}")
+    else:
+        print(f"➕ Created new phone column: {NEW_PHONE_COL}")
+        row_values[1] = NEW_PHONE_COL
+
+    buf = BytesIO()
+    try:
+        with zipfile.ZipFile(BytesIO(original_bytes)) as src:
+            sheet_path = _first_sheet_path(src)
+            with zipfile.ZipFile(buf, "w") as dst:
+                for info in src.infolist():
+                    if info.filename == sheet_path:
+                        # dst.open מאפס גדלים ב-ZipInfo - עותק, כדי שהקריאה מ-src תראה את המקורי
+                        with dst.open(copy.copy(info), "w") as out:
+                            for block in _iter_patched_sheet(src, sheet_path, row_values, phone_col_idx):
+                                out.write(block)
+                    else:
+                        dst.writestr(info, src.read(info), compress_type=info.compress_type)
+    except Exception as e:
+        print(f"⚠️ Workbook patch not possible ({e}) - falling back to full export")
+        return None
+
+    buf.seek(0)
+    print(f"📥 Patched {filled_count} phone cells in original workbook")
+    return buf
+
+def export_with_original_structure(original_file, selected_contacts: dict, skip_filled: bool = False,
+                                   prepared: Optional[ExportFrame] = None) -> BytesIO:
     """
     🔥 ייצוא חכם:
     - מוריד את **כל הקובץ המקורי** (לא רק מה שעובד)
     - אם יש עמודת טלפון קיימת → ממלא אותה
     - אם אין → מוסיף עמודה חדשה בסוף
     - skip_filled: אם True, לא ממלא שורות שיש להן כבר מספר
+    - prepared: ExportFrame מה-session - בלי לקרוא ולזהות את הקובץ מחדש
     """
     try:
-        # קרא את כל הקובץ המקורי
-        if hasattr(original_file, "filename") and str(original_file.filename).lower().endswith(".csv"):
-            df = pd.read_csv(original_file, encoding='utf-8')
-        else:
-            df = pd.read_excel(original_file)
-        
-        df.columns = [str(col).strip() for col in df.columns]
-        
-        print(f"📊 Original file has {len(df)} rows")
-        
-        # זהה עמודת שם
-        name_series = _resolve_full_name_series(df)
-        
-        # חפש עמודת טלפון קיימת
-        column_mapping = smart_column_mapping(df)
-        phone_cols = [col for col, type_val in column_mapping.items() if type_val == 'phone']
-        
-        if phone_cols:
-            # יש עמודת טלפון - מלא אותה
-            phone_col_name = phone_cols[0]
-            print(f"📞 Found existing phone column: {phone_col_name}")
-        else:
-            # אין עמודת טלפון - צור חדשה
-            phone_col_name = "מספר פלאפון"
-            df[phone_col_name] = ""
-            print(f"➕ Created new phone column: {phone_col_name}")
-        
-        # 🔥 מלא את עמודת הטלפון לכל השורות
-        filled_count = 0
-        skipped_count = 0
-        
-        for idx, guest_name in enumerate(name_series):
-            # בדוק אם יש כבר מספר בשורה הזו
-            current_phone = str(df.at[idx, phone_col_name]).strip()
-            has_existing_phone = current_phone and current_phone != '' and current_phone.lower() != 'nan'
-            
-            # אם skip_filled=True ויש מספר - דלג
-            if skip_filled and has_existing_phone:
-                skipped_count += 1
-                continue
-            
-            # אם יש התאמה - מלא
-            if guest_name in selected_contacts:
-                contact = selected_contacts[guest_name]
-                if not contact.get('isNotFound'):
-                    phone = contact.get('phone', '')
-                    if phone:
-                        df.at[idx, phone_col_name] = phone
-                        filled_count += 1
+        if prepared is None:
+            prepared = prepare_export_frame(read_table(original_file))
         
-        print(f"✅ Filled {filled_count} phones")
-        if skip_filled:
-            print(f"⏭️ Skipped {skipped_count} rows (already had phone)")
+        df = fill_export_phones(prepared, selected_contacts, skip_filled)
         
         # ייצא לאקסל
-        buf = BytesIO()
-        with pd.ExcelWriter(buf, engine="openpyxl") as w:
-            df.to_excel(w, index=False, sheet_name="תוצאות")
-        buf.seek(0)
+        buf = BytesIO(b"".join(iter_frame_bytes(df, "xlsx", sheet_name="תוצאות")))
         
         print(f"📥 Exported all {len(df)} rows from original file")
         return buf
@@ -763,11 +1909,69 @@ def to_buf(df: pd.DataFrame) -> BytesIO:
         cols.append(PHONE_COL)
         export = export[cols]
     
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        export.to_excel(w, index=False, sheet_name="תוצאות")
-    buf.seek(0)
-    return buf
+    return BytesIO(b"".join(iter_frame_bytes(export, "xlsx", sheet_name="תוצאות")))
+
+# ───────── כתיבה בסטרימינג (xlsx write-only / csv) ─────────
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_FORMATS = {"xlsx", "csv"}
+
+def _cell_value(value):
+    """NaN / NA → תא ריק (כמו to_excel)"""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+def _iter_xlsx_bytes(df: pd.DataFrame, sheet_name: str) -> Iterator[bytes]:
+    """
+    openpyxl במצב write-only: שורות נכתבות ישר ל-XML בקובץ זמני, בלי אובייקט תא לכל ערך.
+    ה-zip נסגר רק ב-save, ולכן הבתים יוצאים אחרי הכתיבה - בחתיכות מ-SpooledTemporaryFile
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_name)
+    ws.append([str(col) for col in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        ws.append([_cell_value(v) for v in row])
+
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as out:
+        wb.save(out)
+        out.seek(0)
+        while True:
+            chunk = out.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def _iter_csv_bytes(df: pd.DataFrame, rows_per_chunk: int = 1000) -> Iterator[bytes]:
+    """csv ב-UTF-8 עם BOM (כדי שאקסל יציג עברית), חתיכה כל rows_per_chunk שורות"""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow([str(col) for col in df.columns])
+    yield text.getvalue().encode("utf-8-sig")
+    for start in range(0, len(df), rows_per_chunk):
+        text.seek(0)
+        text.truncate()
+        for row in df.iloc[start:start + rows_per_chunk].itertuples(index=False, name=None):
+            writer.writerow(["" if _cell_value(v) is None else v for v in row])
+        yield text.getvalue().encode("utf-8")
+
+def iter_frame_bytes(df: pd.DataFrame, fmt: str = "xlsx", sheet_name: str = "תוצאות") -> Iterator[bytes]:
+    """🔥 הקובץ כזרם bytes ל-StreamingResponse. fmt: xlsx / csv"""
+    if fmt == "csv":
+        return _iter_csv_bytes(df)
+    if fmt == "xlsx":
+        return _iter_xlsx_bytes(df, sheet_name)
+    raise ValueError(f"Unsupported format: {fmt}")
+
+def iter_export_bytes(prepared: ExportFrame, selected_contacts: dict, skip_filled: bool = False,
+                      fmt: str = "xlsx") -> Iterator[bytes]:
+    """ייצוא הקובץ המקורי עם הטלפונים, כזרם bytes (בלי BytesIO של כל הקובץ)"""
+    df = fill_export_phones(prepared, selected_contacts, skip_filled)
+    print(f"📥 Exporting all {len(df)} rows from original file ({fmt})")
+    return iter_frame_bytes(df, fmt, sheet_name="תוצאות")
 
 def create_contacts_template() -> pd.DataFrame:
     """קובץ דוגמה לאנשי קשר"""
@@ -11,15 +11,21 @@
 5. Firestore כ-DB ראשי למשתמשים
 """
 
+import asyncio
+import functools
 import logging
 import sys
+import threading
+import uuid
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 import traceback
 import gc
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
+from session_backend import create_session_backend
 load_dotenv()
 from io import BytesIO
 import tempfile
@@ -71,21 +77,35 @@ try:
 
     from logic import (
         load_excel_flexible,
+        parse_workbook,
         load_mobile_contacts,
+        build_contact_index,
+        estimate_contacts_bytes,
         process_matching_results,
+        iter_matching_results,
         validate_dataframes,
         to_buf,
         export_with_original_structure,
+        export_patched_workbook,
+        iter_frame_bytes,
+        iter_export_bytes,
+        EXPORT_FORMATS,
         check_existing_phone_column,
+        scan_phone_column,
         create_contacts_template,
         create_guests_template,
         NAME_COL,
         PHONE_COL,
         AUTO_SELECT_TH,
+        MAX_PERFECT_RESULTS,
+        MATCH_ENGINE_VERSION,
         format_phone,
         normalize,
+        name_cache_stats,
         reason_for,
     )
+    from result_store import ResultStore
+    from cache_store import BoundedCache, approx_size
     LOGIC_AVAILABLE = True
 
 except ImportError as e:
@@ -131,12 +151,61 @@ def get_storage_client():
 #                    CONFIGURATION
 # ============================================================
 MAX_FILE_SIZE = 50 * 1024 * 1024
+# בקשה עם שני קבצים מקסימליים + שדות הטופס; מעבר לזה נדחה לפי Content-Length לפני קריאת הגוף
+MAX_UPLOAD_REQUEST_SIZE = 2 * MAX_FILE_SIZE + 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 RATE_LIMIT_PER_MINUTE = 100
+MERGE_CONCURRENCY = int(os.environ.get('MERGE_CONCURRENCY', '2'))
+MERGE_JOB_TTL_SECONDS = int(os.environ.get('MERGE_JOB_TTL_SECONDS', '3600'))
+# jobs שממתינים / רצים (כל אחד מחזיק את שני הקבצים בזיכרון) - מעבר לזה 503
+MERGE_JOB_MAX_PENDING = int(os.environ.get('MERGE_JOB_MAX_PENDING', str(4 * MERGE_CONCURRENCY)))
+MERGE_STREAM_QUEUE_SIZE = 256
+# כל כמה שניות producer חסום על תור מלא בודק אם הלקוח התנתק
+MERGE_STREAM_POLL_SECONDS = 0.5
+# לקוח שלא קורא (תור מלא) יותר מ-IDLE שניות, או סטרים שלא הסתיים תוך DEADLINE - נחתך ומשחרר את ה-slot
+MERGE_STREAM_IDLE_TIMEOUT_SECONDS = int(os.environ.get('MERGE_STREAM_IDLE_TIMEOUT_SECONDS', '60'))
+MERGE_STREAM_DEADLINE_SECONDS = int(os.environ.get('MERGE_STREAM_DEADLINE_SECONDS', '900'))
+CONTACTS_CACHE_MAX_BYTES = int(os.environ.get('CONTACTS_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+WORKBOOK_CACHE_MAX_BYTES = int(os.environ.get('WORKBOOK_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(128 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', '1800'))
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR') or None
+# תוצאות שמורות לדפדוף (/merge-results) לפי result_id
+RESULT_STORE_MAX_BYTES = int(os.environ.get('RESULT_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+RESULT_STORE_TTL_SECONDS = int(os.environ.get('RESULT_STORE_TTL_SECONDS', '3600'))
+MATCH_MEMO_MAX_BYTES = int(os.environ.get('MATCH_MEMO_MAX_BYTES', str(64 * 1024 * 1024)))
+MATCH_MEMO_TTL_SECONDS = int(os.environ.get('MATCH_MEMO_TTL_SECONDS', '3600'))
+SESSION_MAX_BYTES = int(os.environ.get('SESSION_MAX_BYTES', str(256 * 1024 * 1024)))
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', str(6 * 3600)))
+# תיקייה פרטית (0700, של המשתמש הנוכחי) - לא קובץ קבוע ב-/tmp שכל אחד יכול ליצור מראש
+SESSION_DIR = os.environ.get('SESSION_DIR', os.path.join(tempfile.gettempdir(), f'guest-matcher-{os.getuid()}'))
+SESSION_SPILL_DIR = os.environ.get('SESSION_SPILL_DIR', os.path.join(SESSION_DIR, 'spill'))
+# sqlite = sessions + rate limit משותפים לכל ה-workers על אותו host; memory = worker יחיד.
+# merge jobs (/merge-jobs) ודפי תוצאות (/merge-results) נשארים בזיכרון ה-worker שהריץ את המיזוג -
+# עם כמה workers צריך sticky routing (אותו לקוח → אותו worker) כדי שה-polling יגיע אליהם
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', os.path.join(SESSION_DIR, 'sessions.db'))
 ALLOWED_FILE_TYPES = {'.xlsx', '.xls', '.csv'}
+# ייצוא: patch (ברירת מחדל, xlsx בלבד) או frame
+EXPORT_MODE = os.environ.get('EXPORT_MODE', 'patch')
 
-# In-Memory
-rate_limit_tracker: Dict[str, list] = {}
-user_sessions: Dict[str, Dict[str, Any]] = {}
+# 🔥 sessions (קובץ המוזמנים המקורי לכל phone, לייצוא) + rate limit - backend נבחר ב-SESSION_BACKEND
+user_sessions = create_session_backend(
+    SESSION_BACKEND, SESSION_MAX_BYTES, SESSION_TTL_SECONDS, SESSION_DB_PATH, SESSION_SPILL_DIR or None
+)
+
+# In-Memory (לכל worker - /merge-results דורש sticky routing כשיש כמה workers)
+result_store = ResultStore(RESULT_STORE_MAX_BYTES, RESULT_STORE_TTL_SECONDS) if LOGIC_AVAILABLE else None
+# 🔥 ספרי אנשי קשר מעובדים (DataFrame + אינדקס) לפי hash הקובץ - משותף לכל הבקשות
+contacts_cache = BoundedCache("contacts", CONTACTS_CACHE_MAX_BYTES) if LOGIC_AVAILABLE else None
+# 🔥 קבצי מוזמנים מפוענחים לפי hash התוכן - משותף ל-check-phone-column / merge / export
+workbook_cache = BoundedCache("workbooks", WORKBOOK_CACHE_MAX_BYTES) if LOGIC_AVAILABLE else None
+# 🔥 תוצאות מיזוג לפי (hash מוזמנים, hash אנשי קשר, מקור, גרסת מנוע) - עם TTL ושכבת דיסק אופציונלית
+results_cache = BoundedCache(
+    "results", RESULT_CACHE_MAX_BYTES, ttl_seconds=RESULT_CACHE_TTL_SECONDS, disk_dir=RESULT_CACHE_DIR
+) if LOGIC_AVAILABLE else None
+# 🔥 מיזוג אינקרמנטלי: לכל session - ההתאמות לפי norm_name מהריצה הקודמת, מול אותם אנשי קשר
+match_memos = BoundedCache("matches", MATCH_MEMO_MAX_BYTES, ttl_seconds=MATCH_MEMO_TTL_SECONDS) if LOGIC_AVAILABLE else None
 
 # ============================================================
 #                    PYDANTIC MODELS
@@ -237,18 +306,9 @@ def log_user_activity(phone: str, activity_type: str, details: dict = None):
 #                    HELPER FUNCTIONS
 # ============================================================
 
-def check_rate_limit(identifier: str) -> bool:
-    now = time.time()
-    if identifier not in rate_limit_tracker:
-        rate_limit_tracker[identifier] = []
-    rate_limit_tracker[identifier] = [
-        req_time for req_time in rate_limit_tracker[identifier]
-        if now - req_time < 60
-    ]
-    if len(rate_limit_tracker[identifier]) >= RATE_LIMIT_PER_MINUTE:
-        return False
-    rate_limit_tracker[identifier].append(now)
-    return True
+async def check_rate_limit(identifier: str) -> bool:
+    """ב-SQLite זו טרנזקציית כתיבה (יכולה לחכות לנעילה של worker אחר) - thread נפרד, לא ה-event loop"""
+    return await asyncio.to_thread(user_sessions.allow_request, identifier, RATE_LIMIT_PER_MINUTE)
 
 def validate_file(file: UploadFile) -> tuple[bool, str]:
     if not file.filename:
@@ -272,6 +332,297 @@ def cleanup_memory():
 def create_file_hash(content: bytes) -> str:
     return hashlib.md5(content).hexdigest()
 
+async def read_upload(file: UploadFile) -> tuple[bytes, str]:
+    """
+    🔥 קריאת העלאה (מה-SpooledTemporaryFile של Starlette) עם md5 באותו מעבר, בלי עותק נוסף של הקובץ:
+    גודל ידוע → קריאה אחת; לא ידוע → חלקים ל-bytearray, ונעצר ברגע שעוברים MAX_FILE_SIZE
+    """
+    if file.size is not None:
+        if file.size > MAX_FILE_SIZE:
+            raise HTTPException(400, "File too large")
+        content = await file.read()
+        return content, hashlib.md5(content).hexdigest()
+    digest = hashlib.md5()
+    buf = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        if len(buf) + len(chunk) > MAX_FILE_SIZE:
+            raise HTTPException(400, "File too large")
+        digest.update(chunk)
+        buf += chunk
+    return bytes(buf), digest.hexdigest()
+
+async def read_merge_uploads(guests_file: UploadFile, contacts_file: UploadFile,
+                             phone: Optional[str], skip_filled_phones: str) -> tuple[bytes, bytes, str, str]:
+    """
+    קורא את שני הקבצים (עם בדיקת גודל ו-hash תוך כדי), ושומר את קובץ המוזמנים המקורי ב-session (לייצוא).
+    מחזיר (guests_bytes, contacts_bytes, file_hash, contacts_hash)
+    """
+    logger.info("📂 Reading files...")
+    guests_bytes, file_hash = await read_upload(guests_file)
+    contacts_bytes, contacts_hash = await read_upload(contacts_file)
+
+    if phone:
+        # כתיבת BLOB של עד 50MB (SQLite / spill לדיסק) - מחוץ ל-event loop
+        await asyncio.to_thread(user_sessions.put, phone, {
+            "original_guests_bytes": guests_bytes,
+            "original_guests_filename": guests_file.filename,
+            "skip_filled_phones": skip_filled_phones.lower() == 'true'
+        }, len(guests_bytes) + 1024)
+
+    return guests_bytes, contacts_bytes, file_hash, contacts_hash
+
+def build_merge_response(sorted_results: List[Dict[str, Any]], file_hash: str, phone: Optional[str]) -> Dict[str, Any]:
+    """מונים, לוג פעילות ותשובת המיזוג"""
+    auto_count = sum(1 for r in sorted_results if r.get("auto_selected"))
+    perfect_count = sum(1 for r in sorted_results if r.get("best_score") == 100)
+
+    # לוג פעילות
+    if phone:
+        log_user_activity(phone, "merge", {
+            "total_guests": len(sorted_results),
+            "auto_selected": auto_count,
+            "perfect_matches": perfect_count
+        })
+
+    logger.info(f"✅ Loaded {len(sorted_results)} guests (no limits)")
+
+    # 🔥 שמירת התוצאות בשרת - לדפדוף וסינון דרך /merge-results/{result_id}
+    result_set = result_store.put(file_hash, sorted_results)
+
+    return {
+        "results": sorted_results,
+        "total_guests": len(sorted_results),
+        "auto_selected_count": auto_count,
+        "perfect_matches_count": perfect_count,
+        "file_hash": file_hash,
+        "result_id": result_set.result_id,
+        "facets": result_set.facet_counts()
+    }
+
+# ============================================================
+#                    MERGE EXECUTOR
+# ============================================================
+
+# 🔥 שלבי ה-CPU של מיזוג רצים מחוץ ל-event loop, עם הגבלת מקביליות
+merge_executor = ThreadPoolExecutor(max_workers=MERGE_CONCURRENCY, thread_name_prefix="merge")
+
+async def run_in_merge_executor(func, *args):
+    """מריץ פונקציה חוסמת ב-merge_executor וממתין לה בלי לחסום את ה-event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(merge_executor, functools.partial(func, *args))
+
+def load_contacts_book(contacts_bytes: bytes, contacts_source: str, contacts_hash: Optional[str] = None):
+    """🔥 ספר אנשי קשר מנורמל + אינדקס התאמה - ממטמון לפי hash התוכן, או פענוח ובנייה"""
+    cache_key = (contacts_hash or create_file_hash(contacts_bytes), contacts_source)
+    cached = contacts_cache.get(cache_key)
+    if cached is not None:
+        logger.info("📞 Contacts loaded from cache")
+        return cached
+
+    logger.info(f"📞 Processing contacts...")
+    if contacts_source == "mobile":
+        contacts_data = json.loads(contacts_bytes.decode('utf-8'))
+        contacts_df = load_mobile_contacts(contacts_data)
+        del contacts_data
+    else:
+        contacts_df = load_excel_flexible(BytesIO(contacts_bytes))
+
+    contacts_index = build_contact_index(contacts_df)
+    contacts_cache.put(
+        cache_key, (contacts_df, contacts_index), estimate_contacts_bytes(contacts_df, contacts_index)
+    )
+    return contacts_df, contacts_index
+
+def load_parsed_workbook(file_bytes: bytes, file_hash: Optional[str] = None):
+    """
+    🔥 קובץ מוזמנים מפוענח (DataFrame גולמי + מיפוי עמודות + שמות) לפי hash התוכן.
+    check-phone-column, merge ו-export משתפים אותו - כל העלאה מפוענחת פעם אחת
+    """
+    cache_key = file_hash or create_file_hash(file_bytes)
+    parsed = workbook_cache.get(cache_key)
+    if parsed is None:
+        parsed = parse_workbook(BytesIO(file_bytes))
+        workbook_cache.put(cache_key, parsed, parsed.nbytes())
+    return parsed
+
+def check_guests_phone_column(guests_bytes: bytes, file_hash: str) -> Dict[str, Any]:
+    """
+    🔥 עמודת טלפון בקובץ המוזמנים: מהקובץ המפוענח אם כבר במטמון, אחרת סריקה של כותרת + עמודה אחת.
+    רק כשאי אפשר לסרוק (csv / xls) - פענוח מלא, שנשמר במטמון בשביל ה-merge
+    """
+    parsed = workbook_cache.get(file_hash)
+    if parsed is None:
+        scanned = scan_phone_column(BytesIO(guests_bytes))
+        if scanned is not None:
+            return scanned
+        try:
+            parsed = load_parsed_workbook(guests_bytes, file_hash)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not parse guests file: {e}")
+    return check_existing_phone_column(BytesIO(guests_bytes), parsed=parsed)
+
+def load_merge_frames(guests_bytes: bytes, contacts_bytes: bytes, contacts_source: str,
+                      file_hash: Optional[str] = None, contacts_hash: Optional[str] = None):
+    """טעינה וולידציה של שני הקבצים - סינכרוני, רץ ב-merge_executor"""
+    logger.info("👰 Processing guests...")
+    guests_df = load_excel_flexible(BytesIO(guests_bytes), parsed=load_parsed_workbook(guests_bytes, file_hash))
+
+    contacts_df, contacts_index = load_contacts_book(contacts_bytes, contacts_source, contacts_hash)
+
+    is_valid, error = validate_dataframes(guests_df, contacts_df)
+    if not is_valid:
+        raise HTTPException(400, error)
+
+    return guests_df, contacts_df, contacts_index
+
+def contacts_match_key(contacts_bytes: bytes, contacts_source: str, contacts_hash: Optional[str] = None) -> tuple:
+    """מזהה של ספר אנשי הקשר + גרסת המנוע - התאמות תקפות רק מול אותו מפתח"""
+    return (contacts_hash or create_file_hash(contacts_bytes), contacts_source, MATCH_ENGINE_VERSION)
+
+def load_match_memo(session: Optional[str], contacts_key: tuple) -> Dict[str, Dict]:
+    """עותק של ההתאמות הקודמות של ה-session, אם היו מול אותם אנשי קשר"""
+    if not session:
+        return {}
+    stored = match_memos.get(session)
+    if stored is None or stored[0] != contacts_key:
+        return {}
+    return dict(stored[1])
+
+def save_match_memo(session: Optional[str], contacts_key: tuple, memo: Dict[str, Dict]):
+    if session:
+        match_memos.put(session, (contacts_key, memo), approx_size(memo))
+
+def run_merge_pipeline(guests_bytes: bytes, contacts_bytes: bytes, contacts_source: str,
+                       progress=None, file_hash: Optional[str] = None,
+                       session: Optional[str] = None, contacts_hash: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    טעינה, ולידציה, התאמה ומיון - סינכרוני, רץ ב-merge_executor.
+    session: אם ידוע - רק שורות ששמן השתנה מאז הריצה הקודמת של ה-session עוברות ציון
+    """
+    contacts_key = contacts_match_key(contacts_bytes, contacts_source, contacts_hash)
+    # 🔥 העלאה זהה (אותם קבצים, מקור וגרסת מנוע) → התוצאה השמורה מיד
+    cache_key = (file_hash or create_file_hash(guests_bytes),) + contacts_key
+    cached = results_cache.get(cache_key)
+    if cached is not None:
+        logger.info("⚡ Merge results loaded from cache")
+        if progress:
+            progress(len(cached), len(cached))
+        return cached
+
+    guests_df, contacts_df, contacts_index = load_merge_frames(
+        guests_bytes, contacts_bytes, contacts_source, cache_key[0], contacts_key[0]
+    )
+
+    logger.info("🔄 Processing matches...")
+    memo = load_match_memo(session, contacts_key)
+    all_results = process_matching_results(
+        guests_df, contacts_df, contacts_source, progress=progress, index=contacts_index, match_memo=memo
+    )
+    save_match_memo(session, contacts_key, memo)
+
+    del guests_df
+    del contacts_df
+
+    # 🔥 NO LIMITS - return ALL results
+    sorted_results = sorted(all_results, key=lambda r: r.get("best_score", 0), reverse=True)
+    results_cache.put(cache_key, sorted_results, approx_size(sorted_results))
+    return sorted_results
+
+# ============================================================
+#                    MERGE JOBS
+# ============================================================
+
+# 🔥 טבלת jobs בזיכרון התהליך - jobs שהסתיימו נמחקים אחרי MERGE_JOB_TTL_SECONDS.
+# לא משותפת בין workers: עם כמה workers ה-polling חייב להגיע לאותו worker (sticky routing)
+merge_jobs: Dict[str, Dict[str, Any]] = {}
+merge_jobs_lock = threading.Lock()
+
+def evict_expired_jobs():
+    """מוחק jobs שהסתיימו לפני יותר מ-MERGE_JOB_TTL_SECONDS"""
+    now = time.time()
+    with merge_jobs_lock:
+        expired = [
+            job_id for job_id, job in merge_jobs.items()
+            if job["finished_ts"] and now - job["finished_ts"] > MERGE_JOB_TTL_SECONDS
+        ]
+        for job_id in expired:
+            del merge_jobs[job_id]
+    if expired:
+        logger.info(f"🧹 Evicted {len(expired)} expired merge jobs")
+
+def _pending_jobs() -> int:
+    """jobs שממתינים / רצים - לקרוא תחת merge_jobs_lock"""
+    return sum(1 for job in merge_jobs.values() if job["status"] in ("queued", "running"))
+
+def _jobs_full_error() -> HTTPException:
+    return HTTPException(503, "Too many merge jobs in progress, please retry shortly",
+                         headers={"Retry-After": "30"})
+
+def reject_if_jobs_full():
+    """🔥 התור של merge_executor לא מוגבל - כל job ממתין מחזיק עד 100MB, ולכן מגבילים כאן"""
+    with merge_jobs_lock:
+        full = _pending_jobs() >= MERGE_JOB_MAX_PENDING
+    if full:
+        raise _jobs_full_error()
+
+def create_merge_job(file_hash: str) -> str:
+    evict_expired_jobs()
+    job_id = uuid.uuid4().hex
+    with merge_jobs_lock:
+        if _pending_jobs() >= MERGE_JOB_MAX_PENDING:
+            raise _jobs_full_error()
+        merge_jobs[job_id] = {
+            "status": "queued",
+            "progress": {"scored": 0, "total": 0},
+            "file_hash": file_hash,
+            "result": None,
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "finished_ts": None,
+        }
+    return job_id
+
+def get_merge_job(job_id: str) -> Dict[str, Any]:
+    evict_expired_jobs()
+    with merge_jobs_lock:
+        job = merge_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found (jobs are kept by the worker that accepted them)")
+    return job
+
+def run_merge_job(job_id: str, guests_bytes: bytes, contacts_bytes: bytes, contacts_source: str,
+                  file_hash: str, phone: Optional[str], contacts_hash: Optional[str] = None):
+    """רץ ב-merge_executor: אותו צינור כמו /merge-files, עם עדכון התקדמות ל-job"""
+    job = merge_jobs[job_id]
+    job["status"] = "running"
+
+    def progress(scored: int, total: int):
+        job["progress"] = {"scored": scored, "total": total}
+
+    try:
+        sorted_results = run_merge_pipeline(
+            guests_bytes, contacts_bytes, contacts_source, progress, file_hash, phone, contacts_hash
+        )
+        response = build_merge_response(sorted_results, file_hash, phone)
+        # 🔥 ה-job שומר רק מונים + result_id; התוצאות עצמן ב-result_store (מוגבל בבתים)
+        response.pop("results")
+        job["result"] = response
+        job["status"] = "done"
+        logger.info(f"✅ Merge job {job_id} done")
+    except HTTPException as e:
+        job["error"] = str(e.detail)
+        job["status"] = "error"
+    except Exception as e:
+        logger.error(f"❌ Merge job {job_id} error: {e}")
+        logger.error(traceback.format_exc())
+        job["error"] = str(e)
+        job["status"] = "error"
+    finally:
+        job["finished_at"] = datetime.now().isoformat()
+        job["finished_ts"] = time.time()
+        cleanup_memory()
+
 # ============================================================
 #                    FASTAPI APP
 # ============================================================
@@ -282,6 +633,15 @@ app = FastAPI(
     description="Open Access - No limits, no SMS verification"
 )
 
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """🔥 בקשה גדולה משני קבצים מקסימליים נדחית לפי Content-Length - לפני שהגוף נקרא ונשמר"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_REQUEST_SIZE:
+        return JSONResponse(status_code=400, content={"detail": "File too large"})
+    return await call_next(request)
+
+# CORS נרשם אחרון כדי לעטוף גם את תשובות הדחייה
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -323,6 +683,15 @@ async def health():
             "logic": LOGIC_AVAILABLE,
             "database": FIRESTORE_AVAILABLE,
             "file_storage": GCS_AVAILABLE,
+        },
+        "caches": {
+            "contacts": contacts_cache.stats() if LOGIC_AVAILABLE else None,
+            "workbooks": workbook_cache.stats() if LOGIC_AVAILABLE else None,
+            "results": results_cache.stats() if LOGIC_AVAILABLE else None,
+            "stored_results": result_store.stats() if LOGIC_AVAILABLE else None,
+            "matches": match_memos.stats() if LOGIC_AVAILABLE else None,
+            "sessions": await asyncio.to_thread(user_sessions.stats),
+            "names": name_cache_stats() if LOGIC_AVAILABLE else None,
         }
     }
 
@@ -346,7 +715,7 @@ async def register_endpoint(data: RegisterRequest):
     if not validate_name(full_name):
         raise HTTPException(400, "שם לא תקין - נדרש לפחות 2 תווים בעברית או אנגלית")
 
-    if not check_rate_limit(phone):
+    if not await check_rate_limit(phone):
         raise HTTPException(429, "יותר מדי בקשות, נסה שוב בעוד דקה")
 
     try:
@@ -387,13 +756,14 @@ async def merge_files(
     phone: Optional[str] = None,
     contacts_source: str = "file",
     skip_filled_phones: str = "false",
+    include_results: str = "true",
     background_tasks: BackgroundTasks = None
 ):
-    """Process and match - NO LIMITS"""
+    """Process and match - NO LIMITS. include_results=false → רק מונים ו-facets, התוצאות דרך /merge-results"""
     if not LOGIC_AVAILABLE:
         raise HTTPException(500, "Logic not available")
 
-    if phone and not check_rate_limit(phone):
+    if phone and not await check_rate_limit(phone):
         raise HTTPException(429, "Too many requests")
 
     for file in [guests_file, contacts_file]:
@@ -402,88 +772,299 @@ async def merge_files(
             raise HTTPException(400, error)
 
     try:
-        logger.info("📂 Reading files...")
-        guests_bytes = await guests_file.read()
-        contacts_bytes = await contacts_file.read()
-
-        if len(guests_bytes) > MAX_FILE_SIZE or len(contacts_bytes) > MAX_FILE_SIZE:
-            raise HTTPException(400, "File too large")
-
-        file_hash = create_file_hash(guests_bytes)
-
-        # שמירת קובץ מקורי ב-session (לייצוא)
-        if phone:
-            user_sessions[phone] = {
-                "original_guests_file": BytesIO(guests_bytes),
-                "original_guests_filename": guests_file.filename,
-                "skip_filled_phones": skip_filled_phones.lower() == 'true'
-            }
-
-        logger.info("👰 Processing guests...")
-        guests_df = load_excel_flexible(BytesIO(guests_bytes))
+        guests_bytes, contacts_bytes, file_hash, contacts_hash = await read_merge_uploads(
+            guests_file, contacts_file, phone, skip_filled_phones
+        )
+
+        # 🔥 העיבוד הכבד רץ ב-executor - ה-event loop נשאר פנוי ל-/health ולשאר הבקשות
+        sorted_results = await run_in_merge_executor(
+            run_merge_pipeline, guests_bytes, contacts_bytes, contacts_source, None, file_hash, phone, contacts_hash
+        )
         del guests_bytes
+        del contacts_bytes
 
-        logger.info(f"📞 Processing contacts...")
-        if contacts_source == "mobile":
-            contacts_data = json.loads(contacts_bytes.decode('utf-8'))
-            contacts_df = load_mobile_contacts(contacts_data)
-            del contacts_data
+        if background_tasks:
+            background_tasks.add_task(cleanup_memory)
         else:
-            contacts_df = load_excel_flexible(BytesIO(contacts_bytes))
+            cleanup_memory()
 
-        del contacts_bytes
+        response = build_merge_response(sorted_results, file_hash, phone)
+        if include_results.lower() == 'false':
+            response["results"] = []
+        return response
 
-        is_valid, error = validate_dataframes(guests_df, contacts_df)
-        if not is_valid:
-            raise HTTPException(400, error)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Merge error: {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(500, str(e))
 
-        logger.info("🔄 Processing matches...")
-        all_results = process_matching_results(guests_df, contacts_df, contacts_source)
 
-        del guests_df
-        del contacts_df
+# ============================================================
+#  MERGE FILES - streaming (NDJSON / SSE)
+# ============================================================
 
-        # 🔥 NO LIMITS - return ALL results
-        sorted_results = sorted(all_results, key=lambda r: r.get("best_score", 0), reverse=True)
+def format_stream_record(record: Dict[str, Any], fmt: str) -> str:
+    """רשומה אחת בפורמט ndjson או sse"""
+    data = json.dumps(record, ensure_ascii=False, default=str)
+    if fmt == "sse":
+        return f"event: {record['type']}\ndata: {data}\n\n"
+    return data + "\n"
 
-        if background_tasks:
-            background_tasks.add_task(cleanup_memory)
-        else:
-            cleanup_memory()
+@app.post("/merge-files/stream")
+async def merge_files_stream(
+    guests_file: UploadFile = File(...),
+    contacts_file: UploadFile = File(...),
+    phone: Optional[str] = None,
+    contacts_source: str = "file",
+    skip_filled_phones: str = "false",
+    format: str = "ndjson",
+):
+    """
+    🔥 מיזוג בסטרימינג: כל מוזמן נשלח כרשומת result ברגע שחושב (לפי סדר הקובץ),
+    ובסוף רשומת summary עם המונים ו-file_hash. format: ndjson / sse
+    """
+    if not LOGIC_AVAILABLE:
+        raise HTTPException(500, "Logic not available")
 
-        auto_count = sum(1 for r in sorted_results if r.get("auto_selected"))
-        perfect_count = sum(1 for r in sorted_results if r.get("best_score") == 100)
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(400, "format must be ndjson or sse")
 
-        # לוג פעילות
-        if phone:
-            log_user_activity(phone, "merge", {
-                "total_guests": len(sorted_results),
-                "auto_selected": auto_count,
-                "perfect_matches": perfect_count
-            })
+    if phone and not await check_rate_limit(phone):
+        raise HTTPException(429, "Too many requests")
+
+    for file in [guests_file, contacts_file]:
+        is_valid, error = validate_file(file)
+        if not is_valid:
+            raise HTTPException(400, error)
 
-        logger.info(f"✅ Loaded {len(sorted_results)} guests (no limits)")
+    guests_bytes, contacts_bytes, file_hash, contacts_hash = await read_merge_uploads(
+        guests_file, contacts_file, phone, skip_filled_phones
+    )
 
-        return {
-            "results": sorted_results,
-            "total_guests": len(sorted_results),
-            "auto_selected_count": auto_count,
-            "perfect_matches_count": perfect_count,
-            "file_hash": file_hash
-        }
+    contacts_key = contacts_match_key(contacts_bytes, contacts_source, contacts_hash)
+    memo = load_match_memo(phone, contacts_key)
 
+    # טעינה וולידציה לפני תחילת הסטרים - שגיאות קלט חוזרות כ-HTTP רגיל
+    try:
+        guests_df, contacts_df, contacts_index = await run_in_merge_executor(
+            load_merge_frames, guests_bytes, contacts_bytes, contacts_source, file_hash, contacts_hash
+        )
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"❌ Merge error: {e}")
-        logger.error(traceback.format_exc())
+        logger.error(f"❌ Merge stream error: {e}")
         raise HTTPException(500, str(e))
+    del guests_bytes
+    del contacts_bytes
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=MERGE_STREAM_QUEUE_SIZE)
+    done = object()
+    # 🔥 stream() מסמן ביציאה (כולל ניתוק לקוח) - ה-producer מפסיק ומשחרר את ה-slot ב-merge_executor
+    cancelled = threading.Event()
+
+    def produce():
+        """רץ ב-merge_executor: מזין תוצאות לתור (עם backpressure מול הלקוח)"""
+        deadline = time.monotonic() + MERGE_STREAM_DEADLINE_SECONDS
+
+        def put(item) -> bool:
+            """מחכה למקום בתור; False אם הלקוח התנתק, או לא קרא בזמן (ואז מסמן cancelled)"""
+            if cancelled.is_set():
+                return False
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            idle_until = min(time.monotonic() + MERGE_STREAM_IDLE_TIMEOUT_SECONDS, deadline)
+            while True:
+                try:
+                    future.result(timeout=MERGE_STREAM_POLL_SECONDS)
+                    return True
+                except FutureTimeoutError:
+                    if not cancelled.is_set() and time.monotonic() >= idle_until:
+                        logger.warning("🐢 Merge stream client too slow - stopping")
+                        cancelled.set()
+                    if cancelled.is_set():
+                        future.cancel()
+                        return False
+
+        perfect_count = 0
+        auto_count = 0
+        total = 0
+        try:
+            for result in iter_matching_results(guests_df, contacts_df, contacts_source, contacts_index, memo):
+                if result["best_score"] == 100:
+                    perfect_count += 1
+                    if perfect_count > MAX_PERFECT_RESULTS:
+                        continue
+                if result.get("auto_selected"):
+                    auto_count += 1
+                total += 1
+                if not put({"type": "result", **result}):
+                    logger.info("🔌 Merge stream client disconnected - stopping")
+                    return
+            save_match_memo(phone, contacts_key, memo)
+            put({
+                "type": "summary",
+                "total_guests": total,
+                "auto_selected_count": auto_count,
+                "perfect_matches_count": min(perfect_count, MAX_PERFECT_RESULTS),
+                "file_hash": file_hash,
+            })
+            if phone:
+                log_user_activity(phone, "merge", {
+                    "total_guests": total,
+                    "auto_selected": auto_count,
+                    "perfect_matches": min(perfect_count, MAX_PERFECT_RESULTS),
+                })
+        except Exception as e:
+            logger.error(f"❌ Merge stream error: {e}")
+            logger.error(traceback.format_exc())
+            put({"type": "error", "message": str(e)})
+        finally:
+            put(done)
+
+    async def stream():
+        producer = loop.run_in_executor(merge_executor, produce)
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), MERGE_STREAM_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    # ה-producer נחתך (לקוח איטי) בלי לשלוח done - מה שבתור נשלח, ואז סוגרים עם שגיאה
+                    if producer.done() and queue.empty():
+                        yield format_stream_record({"type": "error", "message": "Stream timed out"}, format)
+                        break
+                    continue
+                if item is done:
+                    break
+                yield format_stream_record(item, format)
+            await producer
+        finally:
+            cancelled.set()
+            cleanup_memory()
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+# ============================================================
+#  MERGE JOBS - async submit / status / result
+# ============================================================
+
+@app.post("/merge-jobs")
+async def submit_merge_job(
+    request: Request,
+    guests_file: UploadFile = File(...),
+    contacts_file: UploadFile = File(...),
+    phone: Optional[str] = None,
+    contacts_source: str = "file",
+    skip_filled_phones: str = "false",
+):
+    """🔥 מגיש מיזוג כ-job ברקע ומחזיר job_id מיד - הלקוח מתשאל סטטוס במקום להחזיק חיבור"""
+    if not LOGIC_AVAILABLE:
+        raise HTTPException(500, "Logic not available")
+
+    # בלי phone - rate limit לפי כתובת הלקוח
+    client = request.client.host if request.client else "anonymous"
+    if not await check_rate_limit(phone or f"ip:{client}"):
+        raise HTTPException(429, "Too many requests")
+
+    # דחייה מוקדמת, לפני קריאת הקבצים; create_merge_job בודק שוב תחת הנעילה
+    reject_if_jobs_full()
+
+    for file in [guests_file, contacts_file]:
+        is_valid, error = validate_file(file)
+        if not is_valid:
+            raise HTTPException(400, error)
+
+    guests_bytes, contacts_bytes, file_hash, contacts_hash = await read_merge_uploads(
+        guests_file, contacts_file, phone, skip_filled_phones
+    )
+
+    job_id = create_merge_job(file_hash)
+    merge_executor.submit(
+        run_merge_job, job_id, guests_bytes, contacts_bytes, contacts_source, file_hash, phone, contacts_hash
+    )
+    logger.info(f"🧾 Merge job {job_id} queued")
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/merge-jobs/{job_id}")
+async def merge_job_status(job_id: str):
+    """סטטוס והתקדמות של job (מוזמנים שחושבו / סה"כ)"""
+    job = get_merge_job(job_id)
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": dict(job["progress"]),
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+    }
+
+@app.get("/merge-jobs/{job_id}/result")
+async def merge_job_result(job_id: str):
+    """תוצאת job שהסתיים - אותו מבנה כמו /merge-files"""
+    job = get_merge_job(job_id)
+    if job["status"] == "error":
+        raise HTTPException(500, job["error"])
+    if job["status"] != "done":
+        raise HTTPException(409, f"Job not finished ({job['status']})")
+    result_set = result_store.get(job["result"]["result_id"])
+    if result_set is None:
+        raise HTTPException(410, "Job results expired - please resubmit")
+    return {"results": result_set.results, **job["result"]}
+
+
+# ============================================================
+#  MERGE RESULTS - server-side paging & facet filters
+# ============================================================
+
+@app.get("/merge-results/{result_id}")
+async def merge_results_page(
+    result_id: str,
+    cursor: int = 0,
+    page_size: int = 50,
+    tier: Optional[str] = None,
+    side: Optional[str] = None,
+    group: Optional[str] = None,
+    min_score: Optional[int] = None,
+    max_score: Optional[int] = None,
+):
+    """🔥 דף תוצאות מתוך מיזוג שמור: cursor, גודל דף, tier, טווח ציון, צד / קבוצה"""
+    result_set = result_store.get(result_id)
+    if result_set is None:
+        raise HTTPException(404, "No stored results - please re-upload files")
+
+    page = result_set.page(
+        cursor=cursor, page_size=page_size, tier=tier, side=side, group=group,
+        min_score=min_score, max_score=max_score
+    )
+    page["facets"] = result_set.facet_counts()
+    return page
 
 
 # ============================================================
 #  EXPORT RESULTS
 # ============================================================
 
+def prepare_export_chunks(original_bytes: bytes, selected_contacts: dict, skip_filled: bool,
+                          export_format: str, mode: str):
+    """
+    🔥 הקובץ המפוענח מה-merge / check-phone-column (מטמון לפי hash) - בלי לקרוא את האקסל שוב.
+    patch = כתיבת תאי הטלפון בלבד בחוברת המקורית (שומר עיצוב) - במטמון-חסר התוכנית נבנית בסריקת
+    עמודות השם והטלפון ב-XML, בלי pd.read_excel; frame = כתיבה מחדש בסטרימינג
+    """
+    file_hash = create_file_hash(original_bytes)
+    chunks = None
+    if export_format == "xlsx" and mode == "patch":
+        chunks = export_patched_workbook(
+            original_bytes, workbook_cache.get(file_hash), selected_contacts, skip_filled=skip_filled
+        )
+    if chunks is None:
+        export_frame = load_parsed_workbook(original_bytes, file_hash)
+        chunks = iter_export_bytes(export_frame, selected_contacts, skip_filled, export_format)
+    return chunks
+
 @app.post("/export-results")
 async def export_results(request: Request):
     """Export matched results to Excel"""
@@ -492,16 +1073,17 @@ async def export_results(request: Request):
         phone = data.get("phone", "")
         selected_contacts = data.get("selected_contacts", {})
         skip_filled = data.get("skip_filled", False)
-
-        if phone and phone in user_sessions:
-            session = user_sessions[phone]
-            original_file = session["original_guests_file"]
-            original_file.seek(0)
-
-            buf = export_with_original_structure(
-                original_file,
-                selected_contacts,
-                skip_filled=skip_filled
+        export_format = data.get("format", "xlsx")
+        if export_format not in EXPORT_FORMATS:
+            raise HTTPException(400, "format must be xlsx or csv")
+
+        # קריאת ה-session (BLOB של עד 50MB ב-SQLite), פענוח במטמון-חסר ותיקון ה-XML חוסמים -
+        # thread נפרד, כמו check-phone-column
+        session = await asyncio.to_thread(user_sessions.get, phone) if phone else None
+        if session:
+            chunks = await asyncio.to_thread(
+                prepare_export_chunks, session["original_guests_bytes"], selected_contacts,
+                skip_filled, export_format, data.get("mode", EXPORT_MODE)
             )
 
             # לוג
@@ -509,11 +1091,7 @@ async def export_results(request: Request):
                 "contacts_matched": len([c for c in selected_contacts.values() if not c.get("isNotFound")])
             })
 
-            return StreamingResponse(
-                buf,
-                media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                headers={"Content-Disposition": "attachment; filename=guests_matched.xlsx"}
-            )
+            return file_response(chunks, export_format, "guests_matched")
         else:
             raise HTTPException(400, "No session found - please re-upload files")
 
@@ -532,8 +1110,12 @@ async def export_results(request: Request):
 async def check_phone_column(guests_file: UploadFile = File(...)):
     """Check if guests file has a phone column"""
     try:
-        result = check_existing_phone_column(guests_file.file)
+        guests_bytes, file_hash = await read_upload(guests_file)
+        # thread נפרד ולא merge_executor - בדיקה קצרה לא ממתינה בתור מאחורי מיזוגים ארוכים
+        result = await asyncio.to_thread(check_guests_phone_column, guests_bytes, file_hash)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"❌ Check phone column error: {e}")
         raise HTTPException(500, str(e))
@@ -582,31 +1164,31 @@ async def save_files(
 #  TEMPLATES
 # ============================================================
 
-@app.get("/download-contacts-template")
-async def download_contacts_template():
-    template = create_contacts_template()
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        template.to_excel(w, index=False, sheet_name="אנשי קשר")
-    buf.seek(0)
+def file_response(chunks, fmt: str, basename: str) -> StreamingResponse:
+    """StreamingResponse לקובץ xlsx / csv (chunks: איטרטור bytes או BytesIO)"""
+    media_types = {
+        "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "csv": "text/csv; charset=utf-8",
+    }
     return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=contacts_template.xlsx"}
+        chunks,
+        media_type=media_types[fmt],
+        headers={"Content-Disposition": f"attachment; filename={basename}.{fmt}"}
     )
 
+@app.get("/download-contacts-template")
+async def download_contacts_template(format: str = "xlsx"):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, "format must be xlsx or csv")
+    template = create_contacts_template()
+    return file_response(iter_frame_bytes(template, format, sheet_name="אנשי קשר"), format, "contacts_template")
+
 @app.get("/download-guests-template")
-async def download_guests_template():
+async def download_guests_template(format: str = "xlsx"):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, "format must be xlsx or csv")
     template = create_guests_template()
-    buf = BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        template.to_excel(w, index=False, sheet_name="מוזמנים")
-    buf.seek(0)
-    return StreamingResponse(
-        buf,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=guests_template.xlsx"}
-    )
+    return file_response(iter_frame_bytes(template, format, sheet_name="מוזמנים"), format, "guests_template")
 
 
 # ============================================================
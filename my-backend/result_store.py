@@ -0,0 +1,100 @@
+import uuid
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional
+
+from cache_store import BoundedCache, approx_size
+from logic import SIDE_COL, GROUP_COL, result_tier
+
+MAX_PAGE_SIZE = 500
+
+
+class ResultSet:
+    """
+    🔥 תוצאות מיזוג שמורות בשרת + אינדקסי facet (צד / קבוצה / tier).
+    כל אינדקס ממפה ערך → רשימת מיקומים ממוינת, כך שדף מסונן עולה O(page) ולא O(results).
+    """
+
+    def __init__(self, results: List[Dict[str, Any]], file_hash: str, result_id: str):
+        self.results = results
+        self.file_hash = file_hash
+        self.result_id = result_id
+        self.sides = [r.get("guest_details", {}).get(SIDE_COL, "") for r in results]
+        self.groups = [r.get("guest_details", {}).get(GROUP_COL, "") for r in results]
+        self.tiers = [result_tier(r.get("best_score", 0)) for r in results]
+        self.scores = [r.get("best_score", 0) for r in results]
+
+        self.facets: Dict[str, Dict[str, List[int]]] = {"side": {}, "group": {}, "tier": {}}
+        for pos in range(len(results)):
+            self.facets["side"].setdefault(self.sides[pos], []).append(pos)
+            self.facets["group"].setdefault(self.groups[pos], []).append(pos)
+            self.facets["tier"].setdefault(self.tiers[pos], []).append(pos)
+
+    def facet_counts(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {value: len(positions) for value, positions in index.items()}
+            for name, index in self.facets.items()
+        }
+
+    def page(self, cursor: int = 0, page_size: int = 50,
+             tier: Optional[str] = None, side: Optional[str] = None, group: Optional[str] = None,
+             min_score: Optional[int] = None, max_score: Optional[int] = None) -> Dict[str, Any]:
+        """דף תוצאות מ-cursor (מיקום ברשימה) עם סינון - סורק רק את רשימת ה-facet הקצרה ביותר"""
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        filters = {"tier": tier, "side": side, "group": group}
+        active = {name: value for name, value in filters.items() if value is not None}
+
+        if active:
+            postings = [self.facets[name].get(value, []) for name, value in active.items()]
+            candidates = min(postings, key=len)
+            start = bisect_left(candidates, cursor)
+            positions = candidates[start:]
+        else:
+            positions = range(max(cursor, 0), len(self.results))
+
+        items = []
+        next_cursor = None
+        for pos in positions:
+            if tier is not None and self.tiers[pos] != tier:
+                continue
+            if side is not None and self.sides[pos] != side:
+                continue
+            if group is not None and self.groups[pos] != group:
+                continue
+            if min_score is not None and self.scores[pos] < min_score:
+                continue
+            if max_score is not None and self.scores[pos] > max_score:
+                continue
+            if len(items) == page_size:
+                next_cursor = pos
+                break
+            items.append(self.results[pos])
+
+        return {
+            "items": items,
+            "next_cursor": next_cursor,
+            "total_results": len(self.results),
+            "result_id": self.result_id,
+            "file_hash": self.file_hash,
+        }
+
+
+class ResultStore:
+    """
+    מאגר ResultSet לפי result_id אקראי (uuid4) - מוגבל בבתים, עם TTL.
+    המפתח לא נגזר מתוכן הקובץ, כך שמי שמחזיק רק את ה-hash לא יכול לדפדף בתוצאות של אחר.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: Optional[float] = None):
+        self._cache = BoundedCache("merge_results", max_bytes, ttl_seconds=ttl_seconds)
+
+    def put(self, file_hash: str, results: List[Dict[str, Any]]) -> ResultSet:
+        result_set = ResultSet(results, file_hash, uuid.uuid4().hex)
+        # אינדקסי ה-facet שומרים רק מיקומים ומחרוזות קצרות - גודל התוצאות הוא העיקר
+        self._cache.put(result_set.result_id, result_set, approx_size(results))
+        return result_set
+
+    def get(self, result_id: str) -> Optional[ResultSet]:
+        return self._cache.get(result_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
@@ -0,0 +1,180 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional
+
+from cache_store import BoundedCache, ensure_private_dir
+
+
+class MemorySessionBackend:
+    """
+    🔥 sessions + rate limit בזיכרון התהליך (worker יחיד).
+    sessions ב-BoundedCache עם TTL ו-spill לדיסק לפי הצורך.
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, spill_dir: Optional[str] = None):
+        self.sessions = BoundedCache("sessions", max_bytes, ttl_seconds=ttl_seconds, disk_dir=spill_dir, spill=True)
+        self._requests: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        return self.sessions.get(key)
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        self.sessions.put(key, value, size)
+
+    def allow_request(self, identifier: str, limit: int, window_seconds: float = 60) -> bool:
+        now = time.time()
+        with self._lock:
+            recent = [t for t in self._requests.get(identifier, []) if now - t < window_seconds]
+            if len(recent) >= limit:
+                self._requests[identifier] = recent
+                return False
+            recent.append(now)
+            self._requests[identifier] = recent
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", **self.sessions.stats()}
+
+
+def _encode_session(value: Dict[str, Any]) -> tuple[str, Optional[bytes]]:
+    """session → (JSON של השדות הרגילים, השדה הבינארי היחיד אם יש) - בלי pickle"""
+    fields = {k: v for k, v in value.items() if not isinstance(v, bytes)}
+    blobs = [k for k, v in value.items() if isinstance(v, bytes)]
+    if len(blobs) > 1:
+        raise TypeError("session may hold at most one bytes field")
+    if blobs:
+        fields["__blob__"] = blobs[0]
+    return json.dumps(fields, ensure_ascii=False), value[blobs[0]] if blobs else None
+
+def _decode_session(data: str, blob: Optional[bytes]) -> Dict[str, Any]:
+    value = json.loads(data)
+    blob_field = value.pop("__blob__", None)
+    if blob_field is not None:
+        value[blob_field] = bytes(blob)
+    return value
+
+class SQLiteSessionBackend:
+    """
+    🔥 sessions + rate limit בקובץ SQLite משותף - כל ה-workers של uvicorn על אותו host רואים אותם נתונים.
+    מוגבל בבתים (פינוי LRU לפי זמן גישה) ועם TTL לכל session.
+    session = dict עם שדות JSON ולכל היותר שדה bytes אחד (נשמר כ-BLOB) - אין pickle בקריאה מהקובץ.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        ensure_private_dir(os.path.dirname(os.path.abspath(path)))
+        conn = self._connect()
+        os.chmod(path, 0o600)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_entries ("
+            " key TEXT PRIMARY KEY, data TEXT NOT NULL, payload BLOB, size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS session_entries_accessed ON session_entries (accessed_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS requests (identifier TEXT NOT NULL, ts REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS requests_identifier ON requests (identifier, ts)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """חיבור אחד לכל thread; WAL כדי שקריאות לא יחסמו כתיבה מ-worker אחר"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT data, payload FROM session_entries WHERE key = ? AND expires_at > ?", (str(key), now)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE session_entries SET accessed_at = ? WHERE key = ?", (now, str(key)))
+        self.hits += 1
+        return _decode_session(row[0], row[1])
+
+    def put(self, key: Hashable, value: Dict[str, Any], size: int) -> None:
+        conn = self._connect()
+        now = time.time()
+        data, payload = _encode_session(value)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_entries (key, data, payload, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (str(key), data, payload, size, now + self.ttl_seconds, now),
+            )
+            conn.execute("DELETE FROM session_entries WHERE expires_at <= ?", (now,))
+            # פינוי LRU עד שחוזרים לתקציב (ה-session שנכתב עכשיו נשאר)
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM session_entries").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, old_size in conn.execute(
+                    "SELECT key, size FROM session_entries WHERE key != ? ORDER BY accessed_at", (str(key),)
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM session_entries WHERE key = ?", (old_key,))
+                    total -= old_size
+                    self.evictions += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def allow_request(self, identifier: str, limit: int, window_seconds: float = 60) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM requests WHERE ts <= ?", (now - window_seconds,))
+            count = conn.execute(
+                "SELECT COUNT(*) FROM requests WHERE identifier = ?", (identifier,)
+            ).fetchone()[0]
+            allowed = count < limit
+            if allowed:
+                conn.execute("INSERT INTO requests (identifier, ts) VALUES (?, ?)", (identifier, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+    def stats(self) -> Dict[str, Any]:
+        entries, total = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM session_entries WHERE expires_at > ?", (time.time(),)
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def create_session_backend(kind: str, max_bytes: int, ttl_seconds: float,
+                           db_path: str, spill_dir: Optional[str] = None):
+    """sqlite (ברירת מחדל, משותף בין workers) או memory (worker יחיד, עם spill ל-spill_dir)"""
+    if kind == "memory":
+        return MemorySessionBackend(max_bytes, ttl_seconds, spill_dir=spill_dir)
+    if kind == "sqlite":
+        return SQLiteSessionBackend(db_path, max_bytes, ttl_seconds)
+    raise ValueError(f"Unknown session backend: {kind}")
@@ -0,0 +1,92 @@
+"""
+🔥 recall של blocked_scores מול ציון מלא: כל זוג שמגיע ל-MIN_SCORE_DISPLAY בציון המלא
+חייב לצאת מה-blocking עם אותו ציון (הגבול של BLOCK_TSR_CUTOFF עדין - זו רשת הביטחון שלו).
+"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from logic import (
+    MIN_SCORE_DISPLAY, NAME_COL, blocked_scores, build_contact_index, full_score, normalize, score_matrix,
+)
+
+FIRST = ["דני", "דניאל", "שרה", "שרית", "יוסי", "יוסף", "מיכל", "מיכאל", "נועה", "נועם", "אבי", "אביגיל",
+         "john", "jon", "sarah", "david", "dana"]
+LAST = ["כהן", "כהנא", "לוי", "לוין", "מזרחי", "פרץ", "פרידמן", "פרידמן-לוי", "ביטון", "אזולאי",
+        "רוזנברג", "רוזנבלום", "smith", "cohen", "levi"]
+EXTRA = ["עבודה", "נייד", "מילואים", "בית", "של", "משפחת", "דוד"]
+
+
+def _typo(word: str, rnd: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rnd.randrange(len(word))
+    op = rnd.choice(["drop", "swap", "dup"])
+    if op == "drop":
+        return word[:i] + word[i + 1:]
+    if op == "dup":
+        return word[:i] + word[i] + word[i:]
+    j = min(i + 1, len(word) - 1)
+    return word[:i] + word[j] + word[i] + word[j + 1:]
+
+
+def _name(rnd: random.Random) -> str:
+    kind = rnd.random()
+    if kind < 0.05:
+        # רק מילים גנריות / סיומות → שם בלי טוקנים (ענף partial_ratio)
+        return " ".join(rnd.sample(EXTRA, rnd.randint(1, 2)))
+    parts = [rnd.choice(FIRST), rnd.choice(LAST)]
+    if rnd.random() < 0.25:
+        parts.append(rnd.choice(LAST))
+    if rnd.random() < 0.15:
+        parts = [rnd.choice(FIRST)]
+    if rnd.random() < 0.35:
+        parts = [_typo(p, rnd) for p in parts]
+    if rnd.random() < 0.3:
+        extra = rnd.choice(EXTRA)
+        parts = [extra] + parts if rnd.random() < 0.5 else parts + [extra]
+    if rnd.random() < 0.1:
+        parts.reverse()
+    return " ".join(parts)
+
+
+def _frames(seed: int, n_guests: int = 300, n_contacts: int = 800):
+    rnd = random.Random(seed)
+    contacts = [_name(rnd) for _ in range(n_contacts)]
+    contacts += [rnd.choice(contacts) for _ in range(n_contacts // 10)]  # כפילויות בספר
+    guests = [rnd.choice(contacts) if rnd.random() < 0.3 else _name(rnd) for _ in range(n_guests)]
+    contacts_df = pd.DataFrame({NAME_COL: contacts})
+    contacts_df["norm_name"] = [normalize(c) for c in contacts]
+    contacts_df = contacts_df[contacts_df["norm_name"] != ""].reset_index(drop=True)
+    guest_norms = [g for g in (normalize(g) for g in guests) if g]
+    return guest_norms, contacts_df
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_blocked_scores_keep_every_displayable_pair(seed):
+    guest_norms, contacts_df = _frames(seed)
+    index = build_contact_index(contacts_df)
+
+    exhaustive = score_matrix(guest_norms, index)
+    blocked = blocked_scores(guest_norms, index)
+
+    displayable = exhaustive >= MIN_SCORE_DISPLAY
+    assert displayable.any()
+    missed = np.argwhere(displayable & (blocked != exhaustive))
+    assert not len(missed), [
+        (guest_norms[g], index.norms[c], exhaustive[g, c], blocked[g, c]) for g, c in missed[:5]
+    ]
+    # ציון שיצא מה-blocking הוא תמיד הציון המלא
+    scored = blocked > 0
+    assert np.array_equal(blocked[scored], exhaustive[scored])
+
+
+def test_score_matrix_matches_full_score():
+    guest_norms, contacts_df = _frames(7, n_guests=40, n_contacts=120)
+    index = build_contact_index(contacts_df)
+    matrix = score_matrix(guest_norms, index)
+    for gi, g in enumerate(guest_norms):
+        for ci, c in enumerate(index.norms):
+            assert matrix[gi, ci] == full_score(g, c), (g, c)